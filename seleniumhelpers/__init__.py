@@ -1,3 +1,8 @@
 from seleniumhelpers import SeleniumTestCase
 from seleniumhelpers import get_default_timeout
 from seleniumhelpers import get_setting_with_envfallback
+from seleniumhelpers import clear_settings_cache
+from seleniumhelpers import get_browsers
+from seleniumhelpers import get_available_browsers
+from driverpool import DriverPool
+from driverpool import get_driver_pool
@@ -0,0 +1,234 @@
+"""
+Capture the state of the browser when a test fails.
+
+Enabled by the ``SELENIUM_FAILURE_ARTIFACTS`` setting. When a
+:class:`seleniumhelpers.SeleniumTestCase` test fails, the screenshot, page
+source, browser console log and URL are read from the browser in the test
+thread by :func:`.capture_failure`. Decoding, compressing and writing the
+files is done by the background threads of an :class:`.ArtifactWriter`, so
+the test run only waits for the WebDriver commands.
+"""
+import atexit
+import base64
+import gzip
+import json
+import logging
+import os
+import Queue
+import re
+import shutil
+import threading
+import time
+import traceback
+
+
+logger = logging.getLogger('seleniumhelpers.artifacts')
+
+
+def capture_failure(driver, testid, message):
+    """
+    Read the URL, screenshot (as base64 encoded PNG), page source and
+    browser console log from ``driver``. Values that can not be read are
+    left out, and the reason is added to ``errors``.
+
+    :return: A dict for :meth:`.ArtifactWriter.submit`.
+    """
+    state = {'test': testid, 'message': message, 'time': time.time(), 'errors': {}}
+    reads = (('url', lambda: driver.current_url),
+             ('screenshot', driver.get_screenshot_as_base64),
+             ('source', lambda: driver.page_source),
+             ('console', lambda: driver.get_log('browser')))
+    for key, read in reads:
+        try:
+            state[key] = read()
+        except Exception, e: # Never hide the failure we capture artifacts for
+            state['errors'][key] = unicode(e)
+    return state
+
+
+def get_directory_size(path):
+    """
+    Get the total size, in bytes, of the files in ``path``.
+    """
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return size
+
+
+class ArtifactWriter(object):
+    """
+    Writes the artifacts captured by :func:`.capture_failure` to
+    ``<path>/<run>/<subdirectory>/<test id>/`` in ``threads`` background
+    threads, where ``<run>`` is ``run`` (see :func:`.get_run_id`), and
+    ``<subdirectory>`` separates the artifacts of worker processes that
+    share the run (leave it out to write directly to ``<path>/<run>/``).
+    When the artifacts in ``path`` take more than ``maxsize`` bytes, the
+    directories of the oldest runs, except ``run``, are deleted.
+
+    The files written for each failure are ``info.json`` (the test, failure
+    message, URL and time), ``screenshot.png``, ``source.html.gz`` and
+    ``console.json``.
+    """
+    def __init__(self, path, maxsize, run, subdirectory='', threads=2):
+        self.path = path
+        self.maxsize = maxsize
+        self.rundir = os.path.join(path, run)
+        self.directory = os.path.join(self.rundir, subdirectory)
+        self.queue = Queue.Queue()
+        self._names = set()
+        self._lock = threading.Lock()
+        for index in xrange(threads):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, state):
+        """
+        Queue ``state`` (see :func:`.capture_failure`) to be written, and
+        return the directory it will be written to.
+        """
+        name = re.sub(r'[^\w.-]', '_', state['test'])[:150]
+        with self._lock:
+            unique, index = name, 1
+            while unique in self._names:
+                index += 1
+                unique = '{0}-{1}'.format(name, index)
+            self._names.add(unique)
+        directory = os.path.join(self.directory, unique)
+        self.queue.put((directory, state))
+        return directory
+
+    def flush(self):
+        """
+        Wait until all the submitted artifacts have been written.
+        """
+        self.queue.join()
+
+    def _work(self):
+        while True:
+            directory, state = self.queue.get()
+            try:
+                self.write(directory, state)
+                self.evict()
+            except Exception:
+                logger.exception('Failed to write failure artifacts to %s', directory)
+            finally:
+                self.queue.task_done()
+
+    def write(self, directory, state):
+        os.makedirs(directory)
+        info = dict((key, state.get(key)) for key in ('test', 'message', 'url', 'time', 'errors'))
+        with open(os.path.join(directory, 'info.json'), 'w') as infofile:
+            json.dump(info, infofile, indent=2, sort_keys=True)
+        if state.get('screenshot'):
+            with open(os.path.join(directory, 'screenshot.png'), 'wb') as screenshotfile:
+                screenshotfile.write(base64.b64decode(state['screenshot']))
+        if state.get('source') is not None:
+            sourcefile = gzip.open(os.path.join(directory, 'source.html.gz'), 'wb')
+            try:
+                sourcefile.write(state['source'].encode('utf-8'))
+            finally:
+                sourcefile.close()
+        if state.get('console') is not None:
+            with open(os.path.join(directory, 'console.json'), 'w') as consolefile:
+                json.dump(state['console'], consolefile, indent=2)
+        logger.info('Wrote failure artifacts for %s to %s', state['test'], directory)
+
+    def evict(self):
+        """
+        Delete the directories of the oldest runs in :attr:`path`, except the
+        current run, until the artifacts take at most :attr:`maxsize` bytes.
+        """
+        with self._lock:
+            runs = []
+            for name in os.listdir(self.path):
+                rundir = os.path.join(self.path, name)
+                if os.path.isdir(rundir):
+                    runs.append((os.path.getmtime(rundir), rundir, get_directory_size(rundir)))
+            total = sum(size for mtime, rundir, size in runs)
+            for mtime, rundir, size in sorted(runs):
+                if total <= self.maxsize:
+                    break
+                if rundir == self.rundir:
+                    continue
+                shutil.rmtree(rundir, ignore_errors=True)
+                total -= size
+
+
+class FailureCapturingResult(object):
+    """
+    Wraps the result of a :class:`seleniumhelpers.SeleniumTestCase` test to
+    capture the browser state with :func:`.capture_failure` when the test
+    fails, before ``tearDown`` runs.
+    """
+    def __init__(self, result, writer):
+        self._result = result
+        self._writer = writer
+
+    def _capture(self, test, err):
+        try:
+            driver = getattr(test, 'selenium', None)
+            if driver is None:
+                return
+            message = ''.join(traceback.format_exception_only(*err[:2]))
+            if isinstance(message, str):
+                message = message.decode('utf-8', 'replace')
+            self._writer.submit(capture_failure(driver, test.id(), message.strip()))
+        except Exception: # Never break reporting the failure we capture artifacts for
+            logger.exception('Failed to capture failure artifacts for %s', test)
+
+    def addFailure(self, test, err):
+        self._capture(test, err)
+        self._result.addFailure(test, err)
+
+    def addError(self, test, err):
+        self._capture(test, err)
+        self._result.addError(test, err)
+
+    def __getattr__(self, attr):
+        return getattr(self._result, attr)
+
+
+_run_id = None
+_run_pid = None
+
+def get_run_id():
+    """
+    Get the name of the directory for the artifacts of this test run, and
+    create it the first time this is called (``<time>-<pid>``). Worker
+    processes forked after this has been called share the run ID of the
+    main process (see :class:`seleniumhelpers.runner.SeleniumTestRunner`).
+    """
+    global _run_id, _run_pid
+    if _run_id is None:
+        _run_id = '{0}-{1}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        _run_pid = os.getpid()
+    return _run_id
+
+
+_artifact_writer = None
+_artifact_writer_pid = None
+
+def get_artifact_writer(path, maxsize):
+    """
+    Get the process-wide :class:`.ArtifactWriter`, and create it the first
+    time this is called. Worker processes that share the run of the main
+    process (see :func:`.get_run_id`) write to a ``worker-<pid>``
+    subdirectory of the run. The artifacts are flushed at interpreter exit.
+    """
+    global _artifact_writer, _artifact_writer_pid
+    # A forked worker process does not inherit the writer threads
+    if _artifact_writer is None or _artifact_writer_pid != os.getpid():
+        run = get_run_id()
+        subdirectory = ''
+        if _run_pid != os.getpid():
+            subdirectory = 'worker-{0}'.format(os.getpid())
+        _artifact_writer = ArtifactWriter(path, maxsize, run, subdirectory)
+        _artifact_writer_pid = os.getpid()
+        atexit.register(_artifact_writer.flush)
+    return _artifact_writer
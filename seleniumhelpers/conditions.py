@@ -0,0 +1,226 @@
+"""
+Declarative conditions for :meth:`seleniumhelpers.SeleniumTestCase.waitForAll`
+and :meth:`seleniumhelpers.SeleniumTestCase.waitForAny`.
+
+Each condition is a javascript check. A list of conditions is compiled into
+a single javascript predicate with :func:`.compile_conditions`, so checking
+all the conditions only costs one browser round trip.
+
+Conditions that take a ``target`` accept a css selector (the first matching
+element is used) or a ``WebElement``.
+"""
+from django.utils.encoding import force_text
+
+
+class Condition(object):
+    """
+    Base class for conditions.
+
+    Subclasses set :attr:`.script`, and set :attr:`.args` and
+    :attr:`.description` in ``__init__``.
+    """
+
+    #: The body of a javascript function that returns ``true`` when the
+    #: condition holds. Gets :attr:`.args` as ``arguments``, and can use the
+    #: ``findTarget(target, within)`` and ``isDisplayed(element)`` helpers.
+    script = None
+
+    def __init__(self, *args):
+        #: The arguments for :attr:`.script`.
+        self.args = list(args)
+        #: Human readable description used in error messages (unicode).
+        self.description = force_text(self.__class__.__name__)
+
+    def __unicode__(self):
+        return self.description
+
+    def __str__(self):
+        return self.description.encode('utf-8')
+
+
+class CssSelector(Condition):
+    """
+    At least one element matches ``cssselector``.
+
+    :param within: Only search within this element. Defaults to the document.
+    """
+    script = "return (arguments[1] || document).querySelectorAll(arguments[0]).length > 0;"
+
+    def __init__(self, cssselector, within=None):
+        super(CssSelector, self).__init__(cssselector, within)
+        self.description = u'CssSelector("{0}")'.format(force_text(cssselector))
+
+
+class CssSelectorNotFound(Condition):
+    """
+    No elements match ``cssselector``.
+
+    :param within: Only search within this element. Defaults to the document.
+    """
+    script = "return (arguments[1] || document).querySelectorAll(arguments[0]).length == 0;"
+
+    def __init__(self, cssselector, within=None):
+        super(CssSelectorNotFound, self).__init__(cssselector, within)
+        self.description = u'CssSelectorNotFound("{0}")'.format(force_text(cssselector))
+
+
+class _TargetCondition(Condition):
+    def __init__(self, target, within=None):
+        super(_TargetCondition, self).__init__(target, within)
+        if isinstance(target, basestring):
+            self.description = u'{0}("{1}")'.format(self.__class__.__name__, force_text(target))
+        else:
+            self.description = u'{0}(<element {1}>)'.format(self.__class__.__name__,
+                                                            getattr(target, 'id', target))
+
+
+class Displayed(_TargetCondition):
+    """
+    ``target`` exists and is displayed.
+    """
+    script = """
+var element = findTarget(arguments[0], arguments[1]);
+return element != null && isDisplayed(element);
+"""
+
+
+class NotDisplayed(_TargetCondition):
+    """
+    ``target`` does not exist or is hidden.
+    """
+    script = """
+var element = findTarget(arguments[0], arguments[1]);
+return element == null || !isDisplayed(element);
+"""
+
+
+class Enabled(_TargetCondition):
+    """
+    ``target`` exists and is enabled.
+    """
+    script = """
+var element = findTarget(arguments[0], arguments[1]);
+return element != null && !element.disabled;
+"""
+
+
+class Disabled(_TargetCondition):
+    """
+    ``target`` exists and is disabled.
+    """
+    script = """
+var element = findTarget(arguments[0], arguments[1]);
+return element != null && !!element.disabled;
+"""
+
+
+class Text(Condition):
+    """
+    ``text`` is in the text content of the document body, or in the text
+    content of ``within``. The search runs in the browser, so the page source
+    is never transferred.
+
+    :param regex: Treat ``text`` as a javascript regular expression.
+    :param ignorecase: Ignore case when matching.
+    """
+    script = """
+var root = arguments[1] || document.body;
+var content = root.textContent || '';
+if(arguments[2]) {
+    return new RegExp(arguments[0], arguments[3] ? 'i' : '').test(content);
+} else if(arguments[3]) {
+    return content.toLowerCase().indexOf(arguments[0].toLowerCase()) != -1;
+}
+return content.indexOf(arguments[0]) != -1;
+"""
+
+    def __init__(self, text, within=None, regex=False, ignorecase=False):
+        super(Text, self).__init__(text, within, bool(regex), bool(ignorecase))
+        self.description = u'Text("{0}")'.format(force_text(text))
+
+
+class Title(Condition):
+    """
+    The page title equals ``title``.
+    """
+    script = "return document.title == arguments[0];"
+
+    def __init__(self, title):
+        super(Title, self).__init__(title)
+        self.description = u'Title("{0}")'.format(force_text(title))
+
+
+class TitleContains(Condition):
+    """
+    The page title contains ``title``.
+    """
+    script = "return document.title.indexOf(arguments[0]) != -1;"
+
+    def __init__(self, title):
+        super(TitleContains, self).__init__(title)
+        self.description = u'TitleContains("{0}")'.format(force_text(title))
+
+
+#: Javascript function that checks if an element is displayed. Also used by
+#: :meth:`seleniumhelpers.SeleniumTestCase.getElementStates`.
+IS_DISPLAYED_FUNCTION = """
+var isDisplayed = function(element) {
+    if(!(element.offsetWidth || element.offsetHeight || element.getClientRects().length)) {
+        return false;
+    }
+    var style = window.getComputedStyle(element);
+    return style.visibility != 'hidden' && style.display != 'none';
+};
+"""
+
+PREDICATE_SCRIPT = IS_DISPLAYED_FUNCTION + """
+var findTarget = function(target, within) {
+    if(typeof target == 'string') {
+        return (within || document).querySelector(target);
+    }
+    return target;
+};
+var checks = [%(checks)s];
+var argLists = arguments[0];
+var mode = arguments[1];
+var results = [];
+for(var i = 0; i < checks.length; i++) {
+    try {
+        results.push(!!checks[i].apply(null, argLists[i]));
+    } catch(e) {
+        results.push(false);
+    }
+}
+if(mode == 'all') {
+    return results.indexOf(false) == -1;
+} else if(mode == 'any') {
+    return results.indexOf(true) != -1 && results;
+}
+return results;
+"""
+
+#: Modes for :func:`.compile_conditions`.
+MODE_ALL = 'all'
+MODE_ANY = 'any'
+MODE_EVALUATE = 'evaluate'
+
+
+def compile_conditions(conditions, mode):
+    """
+    Compile ``conditions`` into a single javascript predicate.
+
+    :param mode:
+        :data:`.MODE_ALL`: The predicate returns ``true`` when all the
+        conditions hold.
+        :data:`.MODE_ANY`: The predicate returns a list with ``true`` for each
+        condition that holds when at least one condition holds.
+        :data:`.MODE_EVALUATE`: The predicate returns a list with ``true`` or
+        ``false`` for each condition.
+    :return: A ``(script, args)`` tuple for
+        :func:`seleniumhelpers.waits.wait_for_script` or ``execute_script``.
+    """
+    checks = ','.join('function() {{\n{0}\n}}'.format(condition.script)
+                      for condition in conditions)
+    script = PREDICATE_SCRIPT % {'checks': checks}
+    args = [[condition.args for condition in conditions], mode]
+    return script, args
@@ -0,0 +1,119 @@
+"""
+Process-wide pool of started WebDriver objects, shared by all
+:class:`seleniumhelpers.SeleniumTestCase` classes in a test run.
+"""
+import atexit
+import threading
+
+from selenium.common.exceptions import WebDriverException
+
+
+CLEAR_STORAGE_SCRIPT = """
+try { window.localStorage.clear(); } catch(e) {}
+try { window.sessionStorage.clear(); } catch(e) {}
+"""
+
+
+def reset_driver(driver):
+    """
+    Reset the state of ``driver`` so that it can be handed out to another test
+    class. Closes all windows except the first one, clears cookies,
+    localStorage and sessionStorage, and loads ``about:blank``.
+    """
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    driver.execute_script(CLEAR_STORAGE_SCRIPT)
+    driver.delete_all_cookies()
+    driver.get('about:blank')
+
+
+class DriverPool(object):
+    """
+    Keeps warm WebDriver objects alive for the whole test run.
+
+    Drivers are stored by a key (:class:`seleniumhelpers.SeleniumTestCase` uses
+    the ``(browser, use_rc)`` arguments to
+    :meth:`seleniumhelpers.SeleniumTestCase.getDriver`, and the ``getDriver``
+    and ``getDriverKwargs`` methods of the test class). Use :meth:`.acquire`
+    to get a driver, and :meth:`.release` to give it back when you are done
+    with it. Every driver created by the pool is quit at interpreter exit.
+
+    :param maxsize: The maximum number of idle drivers kept alive. Drivers
+        released when the pool is full are quit.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._idle = {}
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        """
+        Get an idle driver stored with the given ``key``, or create one by
+        calling ``factory()`` if no idle driver is available.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        driver = factory()
+        with self._lock:
+            self._drivers.append(driver)
+        return driver
+
+    def release(self, key, driver):
+        """
+        Reset ``driver`` using :func:`.reset_driver` and make it available
+        for :meth:`.acquire`. The driver is quit if resetting it fails, or if
+        the pool already contains ``maxsize`` idle drivers.
+        """
+        try:
+            reset_driver(driver)
+        except WebDriverException:
+            self._quit(driver)
+            return
+        with self._lock:
+            idlecount = sum(len(drivers) for drivers in self._idle.itervalues())
+            if idlecount < self.maxsize:
+                self._idle.setdefault(key, []).append(driver)
+                return
+        self._quit(driver)
+
+    def _quit(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass # The browser is already gone
+
+    def quit_all(self):
+        """
+        Quit all drivers created by the pool, including drivers that have not
+        been released.
+        """
+        with self._lock:
+            drivers = list(self._drivers)
+            self._idle = {}
+        for driver in drivers:
+            self._quit(driver)
+
+
+_driver_pool = None
+
+def get_driver_pool(maxsize):
+    """
+    Get the process-wide :class:`.DriverPool`, creating it on the first call.
+    The pool is quit using :meth:`.DriverPool.quit_all` at interpreter exit.
+
+    :param maxsize: Forwarded to :class:`.DriverPool` when the pool is created.
+    """
+    global _driver_pool
+    if _driver_pool is None:
+        _driver_pool = DriverPool(maxsize)
+        atexit.register(_driver_pool.quit_all)
+    return _driver_pool
@@ -0,0 +1,47 @@
+"""
+Element cache used by
+:meth:`seleniumhelpers.SeleniumTestCase.waitForAndFindElementByCssSelector`
+when ``SELENIUM_ELEMENT_CACHE`` is enabled.
+"""
+from selenium.common.exceptions import StaleElementReferenceException
+
+
+class ElementCache(object):
+    """
+    Caches the elements matching css selectors for the current page, keyed
+    by ``(within, cssselector)``. Cleared by
+    :meth:`seleniumhelpers.SeleniumTestCase.getPath`. Cached elements are
+    checked before they are returned, and elements that have become stale
+    (E.g.: because the browser has navigated to another page, or the element
+    has been re-rendered) are removed from the cache.
+    """
+    def __init__(self):
+        self._elements = {}
+
+    def _getKey(self, within, cssselector):
+        return (getattr(within, 'id', None), cssselector)
+
+    def get(self, within, cssselector):
+        """
+        Get the cached element for ``(within, cssselector)``, or ``None`` if
+        it is not cached or has become stale.
+        """
+        key = self._getKey(within, cssselector)
+        element = self._elements.get(key)
+        if element is None:
+            return None
+        try:
+            element.is_enabled() # Fails if the element is stale
+        except StaleElementReferenceException:
+            del self._elements[key]
+            return None
+        return element
+
+    def add(self, within, cssselector, element):
+        """
+        Cache ``element`` for ``(within, cssselector)``.
+        """
+        self._elements[self._getKey(within, cssselector)] = element
+
+    def clear(self):
+        self._elements.clear()
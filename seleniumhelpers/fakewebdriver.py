@@ -0,0 +1,280 @@
+"""
+Fake WebDriver server for benchmarking the helpers of
+:class:`seleniumhelpers.SeleniumTestCase` without a browser.
+
+The server speaks enough of the JSON Wire protocol for ``webdriver.Remote``
+and the ``waitFor*`` methods. It does not run javascript. Instead, the
+elements on a page are given by the query string of the URL the browser
+navigates to, as ``<css selector>=<seconds>`` pairs, where ``<seconds>`` is
+how long after the page load the element appears::
+
+    driver.get('http://fake.invalid/?%23result=0.5')
+
+Finding elements and the wait scripts of :mod:`seleniumhelpers.waits`
+resolve from this (the wait scripts resolve as soon as the element
+appears, like in a browser). Other commands succeed with a ``null`` value.
+Every command is delayed by the configured latency, to emulate a remote
+browser.
+
+Use :class:`.FakeWebDriverProcess` to run the server in a child process, so
+the CPU time spent by the server is not counted in the benchmarks.
+"""
+import BaseHTTPServer
+import itertools
+import json
+import multiprocessing
+import re
+import SocketServer
+import threading
+import time
+import urllib2
+import urlparse
+
+import waits
+
+
+#: Path prefix of the requests that control the server. They are not
+#: delayed or counted.
+CONTROL_PATH = '/fakewebdriver/'
+
+#: JSON Wire status codes.
+STATUS_SUCCESS = 0
+STATUS_NO_SUCH_ELEMENT = 7
+
+
+class FakePage(object):
+    """
+    The page loaded in a session of :class:`.FakeWebDriverServer`.
+    """
+    def __init__(self, url=None):
+        self.url = url
+        self.loaded = time.time()
+        #: Maps css selectors to the number of seconds after :attr:`loaded`
+        #: when they appear.
+        self.elements = {}
+        if url:
+            query = urlparse.urlsplit(url).query
+            for selector, delay in urlparse.parse_qsl(query):
+                self.elements[selector] = float(delay or 0)
+
+    def getRemaining(self, selector):
+        """
+        Get the number of seconds until ``selector`` appears, or ``None`` if
+        it is not on the page.
+        """
+        if selector not in self.elements:
+            return None
+        return max(self.loaded + self.elements[selector] - time.time(), 0)
+
+    def isFound(self, selector):
+        return self.getRemaining(selector) == 0
+
+
+class FakeWebDriverRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles a request sent to :class:`.FakeWebDriverServer`.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Send each response in a single packet, so the fake server does not add
+    # delayed ACK latency to keep-alive connections.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        self.server.recordConnection()
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def handleRequest(self):
+        body = None
+        if 'Content-Length' in self.headers:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        params = json.loads(body) if body else {}
+        if self.path.startswith(CONTROL_PATH):
+            self.reply(self.server.control(self.path[len(CONTROL_PATH):], params))
+            return
+        command = self.server.getCommandName(self.command, self.path)
+        self.server.recordCommand(command)
+        time.sleep(self.server.latency)
+        self.reply(self.server.execute(command, self.path, params))
+
+    do_GET = do_POST = do_DELETE = handleRequest
+
+    def reply(self, response):
+        content = json.dumps(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', len(content))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeWebDriverServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Fake WebDriver server (see the module docs).
+
+    :param latency: Seconds to delay each command.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, address=('127.0.0.1', 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeWebDriverRequestHandler)
+        self.latency = latency
+        self.pages = {}
+        self.commands = {}
+        self.connections = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """
+        The URL to use as the ``command_executor`` of ``webdriver.Remote``.
+        """
+        return 'http://{0}:{1}/wd/hub'.format(*self.server_address)
+
+    def recordConnection(self):
+        with self._lock:
+            self.connections += 1
+
+    def recordCommand(self, command):
+        with self._lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+    def getStats(self):
+        """
+        Get the number of connections opened, and the number of requests for
+        each command as ``"<method> <command>"`` (E.g.: ``"POST element"``).
+        """
+        with self._lock:
+            return {'connections': self.connections, 'commands': dict(self.commands)}
+
+    def control(self, action, params):
+        if action == 'stats':
+            return self.getStats()
+        elif action == 'config':
+            self.latency = float(params.get('latency', self.latency))
+        elif action == 'reset':
+            with self._lock:
+                self.commands = {}
+                self.connections = 0
+        return None
+
+    def getCommandName(self, method, path):
+        """
+        Get the command of a request as ``"<method> <path without ids>"``.
+        """
+        path = urlparse.urlsplit(path).path
+        path = re.sub(r'^(?:/wd/hub)?/session', '', path)
+        path = re.sub(r'^/[^/]+/?', '', path)
+        path = re.sub(r'^element/[^/]+/', 'element/:id/', path)
+        return '{0} {1}'.format(method, path or 'session')
+
+    def success(self, sessionid, value=None, status=STATUS_SUCCESS):
+        return {'sessionId': sessionid, 'status': status, 'value': value}
+
+    def execute(self, command, path, params):
+        match = re.match(r'^(?:/wd/hub)?/session/([^/]+)', path)
+        sessionid = match.group(1) if match else None
+        if command == 'POST session':
+            sessionid = 'fake-{0}'.format(next(self._ids))
+            self.pages[sessionid] = FakePage()
+            capabilities = dict(params.get('desiredCapabilities', {}), javascriptEnabled=True)
+            return self.success(sessionid, capabilities)
+        page = self.pages.get(sessionid) or FakePage()
+        if command == 'DELETE session':
+            self.pages.pop(sessionid, None)
+        elif command == 'POST url':
+            self.pages[sessionid] = FakePage(params['url'])
+        elif command == 'GET url':
+            return self.success(sessionid, page.url)
+        elif command in ('POST element', 'POST element/:id/element'):
+            selector = params.get('value')
+            if params.get('using') == 'css selector' and page.isFound(selector):
+                return self.success(sessionid, self.getElement(selector))
+            return self.success(sessionid, {'message': 'Unable to locate {0}'.format(selector)},
+                                status=STATUS_NO_SUCH_ELEMENT)
+        elif command in ('POST elements', 'POST element/:id/elements'):
+            selector = params.get('value')
+            if params.get('using') == 'css selector' and page.isFound(selector):
+                return self.success(sessionid, [self.getElement(selector)])
+            return self.success(sessionid, [])
+        elif command == 'POST execute_async':
+            return self.success(sessionid, self.executeWaitScript(page, params))
+        return self.success(sessionid)
+
+    def getElement(self, selector):
+        return {'ELEMENT': 'element-{0}'.format(selector.encode('hex'))}
+
+    def executeWaitScript(self, page, params):
+        script, args = params.get('script', ''), params.get('args', [])
+        if waits.CSS_SELECTOR_FOUND not in script and waits.CSS_SELECTOR_NOT_FOUND not in script:
+            return None
+        timeout, selector = args[0] / 1000.0, args[2]
+        remaining = page.getRemaining(selector)
+        if waits.CSS_SELECTOR_NOT_FOUND in script:
+            # Elements do not disappear from fake pages
+            if remaining == 0:
+                time.sleep(timeout)
+                return False
+            return True
+        if remaining is None or remaining > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(remaining)
+        return [self.getElement(selector)]
+
+
+def _serve(connection, latency):
+    server = FakeWebDriverServer(latency)
+    connection.send(server.url)
+    server.serve_forever()
+
+
+class FakeWebDriverProcess(object):
+    """
+    Runs a :class:`.FakeWebDriverServer` in a child process.
+
+    :param latency: Seconds to delay each command.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.url = None
+        self._process = None
+
+    def start(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child, self.latency))
+        self._process.daemon = True
+        self._process.start()
+        self.url = parent.recv()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def _control(self, action, params=None):
+        url = '{0}{1}{2}'.format(self.url.replace('/wd/hub', ''), CONTROL_PATH, action)
+        data = json.dumps(params) if params is not None else None
+        return json.loads(urllib2.urlopen(url, data).read())
+
+    def getStats(self):
+        """
+        See :meth:`.FakeWebDriverServer.getStats`.
+        """
+        return self._control('stats')
+
+    def setLatency(self, latency):
+        """
+        Set the number of seconds to delay each command.
+        """
+        self.latency = latency
+        self._control('config', {'latency': latency})
+
+    def reset(self):
+        """
+        Reset the stats.
+        """
+        self._control('reset', {})
@@ -0,0 +1,119 @@
+"""
+History of the duration of each :class:`seleniumhelpers.SeleniumTestCase`
+test and test class, stored between test runs.
+
+Used by :class:`seleniumhelpers.runner.SeleniumTestRunner` to run the slowest
+test classes first, to split test classes into shards with roughly the same
+duration, and to flag tests that are slower than usual.
+"""
+import json
+
+
+def median(values):
+    """
+    Get the median of ``values``, or ``None`` if ``values`` is empty.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class DurationHistory(object):
+    """
+    The durations, in seconds, of the last ``size`` runs of each test and
+    each test class, stored as compact JSON in ``path``::
+
+        {"classes": {"<module>.<class>": [seconds, ...]},
+         "tests": {"<module>.<class>.<method>": [seconds, ...]}}
+
+    The duration of a test class is the sum of the durations of its tests.
+    """
+    def __init__(self, path=None, size=10):
+        self.path = path
+        self.size = size
+        self.classes = {}
+        self.tests = {}
+        if path:
+            self.load()
+
+    def load(self):
+        """
+        Load the history from :attr:`path`. The history is empty if the file
+        does not exist or can not be parsed.
+        """
+        try:
+            with open(self.path) as historyfile:
+                data = json.load(historyfile)
+        except (IOError, ValueError):
+            data = {}
+        self.classes = data.get('classes', {})
+        self.tests = data.get('tests', {})
+
+    def save(self):
+        """
+        Save the history to :attr:`path`.
+        """
+        with open(self.path, 'w') as historyfile:
+            json.dump({'classes': self.classes, 'tests': self.tests}, historyfile,
+                      separators=(',', ':'), sort_keys=True)
+
+    def _add(self, history, durations):
+        for key, seconds in durations.iteritems():
+            runs = history.setdefault(key, [])
+            runs.append(round(seconds, 3))
+            del runs[:-self.size]
+
+    def addRun(self, testdurations):
+        """
+        Add the durations of a test run.
+
+        :param testdurations: A ``{test id: seconds}`` dict, where the test id
+            is ``<module>.<class>.<method>`` (the ``id()`` of the test).
+        """
+        classdurations = {}
+        for testid, seconds in testdurations.iteritems():
+            classid = testid.rsplit('.', 1)[0]
+            classdurations[classid] = classdurations.get(classid, 0.0) + seconds
+        self._add(self.tests, testdurations)
+        self._add(self.classes, classdurations)
+
+    def getClassDurations(self):
+        """
+        Get the median duration of each test class as a ``{class id:
+        seconds}`` dict.
+        """
+        return dict((classid, median(runs)) for classid, runs in self.classes.iteritems() if runs)
+
+    def getTestMedian(self, testid):
+        """
+        Get the median duration of the test ``testid``, or ``None`` if the
+        test has not been run before.
+        """
+        return median(self.tests.get(testid, []))
+
+    def findRegressions(self, testdurations, threshold, minruns=3, minseconds=0.5):
+        """
+        Find tests in ``testdurations`` (see :meth:`.addRun`) that are more
+        than ``threshold`` percent slower than their median duration. Call
+        this before adding the run with :meth:`.addRun`.
+
+        :param minruns: Ignore tests with fewer runs in the history.
+        :param minseconds: Ignore tests that are less than ``minseconds``
+            slower than their median duration.
+        :return: A list of ``(test id, seconds, median seconds)`` tuples,
+            the largest slowdown first.
+        """
+        regressions = []
+        for testid, seconds in testdurations.iteritems():
+            runs = self.tests.get(testid, [])
+            if len(runs) < minruns:
+                continue
+            usual = median(runs)
+            if seconds - usual >= minseconds and seconds > usual * (1 + threshold / 100.0):
+                regressions.append((testid, seconds, usual))
+        regressions.sort(key=lambda item: item[1] - item[2], reverse=True)
+        return regressions
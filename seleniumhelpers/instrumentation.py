@@ -0,0 +1,399 @@
+"""
+Opt-in timing instrumentation for WebDriver commands and waits.
+
+Enabled by the ``SELENIUM_TIMING_REPORT`` setting. When enabled,
+:class:`seleniumhelpers.SeleniumTestCase` creates a :class:`.TimingRecorder`
+with :func:`.enable_recorder`, wraps its drivers with
+:func:`.instrument_driver`, and the wait functions in
+:mod:`seleniumhelpers.waits` record each wait. When disabled,
+:func:`.get_recorder` returns ``None`` and nothing is recorded.
+"""
+import atexit
+import json
+import sys
+import threading
+import time
+
+import pagetimings
+import queries
+
+
+def _newstats():
+    return {'count': 0, 'seconds': 0.0, 'max': 0.0}
+
+def _addstats(stats, seconds):
+    stats['count'] += 1
+    stats['seconds'] += seconds
+    stats['max'] = max(stats['max'], seconds)
+
+def _mergestats(target, stats):
+    for name, values in stats.iteritems():
+        merged = target.setdefault(name, dict((key, 0) for key in values))
+        for key, value in values.iteritems():
+            if key == 'max':
+                merged[key] = max(merged[key], value)
+            else:
+                merged[key] += value
+
+
+class TimingRecorder(object):
+    """
+    Records the latency of WebDriver commands, the time, poll count and
+    timeouts of waits, and the time the live server spent on each request,
+    grouped by test. Also records the SQL queries run by the live server for
+    each request, the requests handled by the proxy, and the timings of each
+    page, grouped by path.
+    """
+    #: The name used for commands and waits outside of a test (E.g.: in
+    #: ``setUpClass``).
+    CLASS_LEVEL = '<class>'
+
+    def __init__(self):
+        self.currentClass = None
+        self.currentTest = None
+        self.tests = {}
+        self.waits = []
+        self.pages = {}
+        self.duplicateQueries = []
+        #: The remote connection stats merged from other recorders.
+        self.remoteConnections = {}
+        self._poppedConnections = {}
+        self._lock = threading.Lock()
+
+    def startClass(self, classid):
+        self.currentClass = classid
+        self.currentTest = None
+
+    def startTest(self, testid):
+        self.currentTest = testid
+
+    def stopTest(self):
+        self.currentTest = None
+
+    def _getTestStats(self):
+        key = (self.currentClass, self.currentTest or self.CLASS_LEVEL)
+        stats = self.tests.get(key)
+        if stats is None:
+            stats = self.tests[key] = {'commands': {}, 'waits': {}, 'requests': {}, 'queries': {},
+                                       'proxy': {}}
+        return stats
+
+    def recordCommand(self, command, seconds):
+        """
+        Record that the WebDriver ``command`` took ``seconds``.
+        """
+        with self._lock:
+            commands = self._getTestStats()['commands']
+            _addstats(commands.setdefault(command, _newstats()), seconds)
+
+    def recordRequest(self, request, seconds):
+        """
+        Record that the live server spent ``seconds`` handling ``request``
+        (``"<method> <path>"``).
+        """
+        with self._lock:
+            requests = self._getTestStats()['requests']
+            _addstats(requests.setdefault(request, _newstats()), seconds)
+
+    def recordProxyRequest(self, method, url, action, seconds):
+        """
+        Record that :class:`seleniumhelpers.proxy.StubProxyServer` spent
+        ``seconds`` on a request for ``url``. ``action`` is ``allowed``,
+        ``fixture`` or ``blocked``.
+        """
+        request = '{0} {1} {2}'.format(action, method, url.split('?', 1)[0])
+        with self._lock:
+            requests = self._getTestStats()['proxy']
+            _addstats(requests.setdefault(request, _newstats()), seconds)
+
+    def recordQueries(self, request, querylist):
+        """
+        Record the SQL queries the live server ran while handling ``request``
+        (``"<method> <path>"``). Used as a callback for
+        :func:`seleniumhelpers.queries.start_capture`.
+        """
+        with self._lock:
+            stats = self._getTestStats()['queries'].setdefault(request, {'requests': 0, 'count': 0,
+                                                                         'seconds': 0.0, 'max': 0})
+            stats['requests'] += 1
+            stats['count'] += len(querylist)
+            stats['seconds'] += sum(query['time'] for query in querylist)
+            stats['max'] = max(stats['max'], len(querylist))
+            testid = '{0}:{1}'.format(self.currentClass, self.currentTest or self.CLASS_LEVEL)
+            for count, sql in queries.find_duplicates(querylist):
+                self.duplicateQueries.append((count, sql, request, testid))
+
+    def recordPage(self, path, timings):
+        """
+        Record the page ``timings`` (see
+        :func:`seleniumhelpers.pagetimings.get_page_timings`) of the page at
+        ``path``. Pages are grouped by path, not by test.
+        """
+        with self._lock:
+            stats = self.pages.setdefault(path, {'count': 0})
+            stats['count'] += 1
+            for metric in pagetimings.METRICS:
+                value = timings.get(metric)
+                if value is None:
+                    continue
+                metricstats = stats.setdefault(metric, {'count': 0, 'total': 0, 'max': 0})
+                metricstats['count'] += 1
+                metricstats['total'] += value
+                metricstats['max'] = max(metricstats['max'], value)
+
+    def recordWait(self, name, seconds, polls, timedout):
+        """
+        Record a wait named ``name`` that took ``seconds`` and checked its
+        condition ``polls`` times.
+        """
+        with self._lock:
+            waits = self._getTestStats()['waits']
+            stats = waits.setdefault(name, dict(_newstats(), polls=0, timeouts=0))
+            _addstats(stats, seconds)
+            stats['polls'] += polls
+            stats['timeouts'] += int(timedout)
+            testid = '{0}:{1}'.format(self.currentClass, self.currentTest or self.CLASS_LEVEL)
+            self.waits.append((seconds, name, testid, polls, timedout))
+
+    def popState(self):
+        """
+        Get the recorded timings, and the remote connection stats counted
+        since the last call, in a form that can be pickled and merged into
+        another recorder with :meth:`.merge`, and clear the recorded timings.
+        Used to send the timings of worker processes to the main process.
+        """
+        import remote # Imports selenium.webdriver, which is slow
+        connections = remote.get_connection_stats()
+        with self._lock:
+            state = {'tests': self.tests, 'waits': self.waits, 'pages': self.pages,
+                     'duplicateQueries': self.duplicateQueries,
+                     'remoteConnections': dict((key, value - self._poppedConnections.get(key, 0))
+                                               for key, value in connections.iteritems())}
+            self.tests = {}
+            self.waits = []
+            self.pages = {}
+            self.duplicateQueries = []
+            self._poppedConnections = connections
+        return state
+
+    def merge(self, state):
+        """
+        Add the timings in ``state`` (see :meth:`.popState`) to this recorder.
+        """
+        with self._lock:
+            for key, stats in state['tests'].iteritems():
+                merged = self.tests.setdefault(key, {'commands': {}, 'waits': {}, 'requests': {},
+                                                     'queries': {}, 'proxy': {}})
+                for group, groupstats in stats.iteritems():
+                    _mergestats(merged[group], groupstats)
+            self.waits.extend(state['waits'])
+            self.duplicateQueries.extend(state['duplicateQueries'])
+            for path, stats in state['pages'].iteritems():
+                merged = self.pages.setdefault(path, {'count': 0})
+                merged['count'] += stats['count']
+                _mergestats(merged, dict((metric, metricstats)
+                                         for metric, metricstats in stats.iteritems()
+                                         if metric != 'count'))
+            for key, value in state['remoteConnections'].iteritems():
+                self.remoteConnections[key] = self.remoteConnections.get(key, 0) + value
+
+    def getReport(self, top=10):
+        """
+        Get the recorded timings as a dict with the stats for each test and
+        each test class, and the ``top`` slowest tests, commands and waits.
+        """
+        with self._lock:
+            tests = {}
+            classes = {}
+            commands = {}
+            requests = {}
+            querystats = {}
+            proxystats = {}
+            for (classid, testid), stats in self.tests.iteritems():
+                commandseconds = sum(command['seconds'] for command in stats['commands'].itervalues())
+                waitseconds = sum(wait['seconds'] for wait in stats['waits'].itervalues())
+                tests['{0}:{1}'.format(classid, testid)] = dict(stats,
+                                                                command_seconds=commandseconds,
+                                                                wait_seconds=waitseconds)
+                classstats = classes.setdefault(classid, {'commands': {}, 'waits': {},
+                                                          'requests': {}, 'queries': {}, 'proxy': {},
+                                                          'command_seconds': 0.0,
+                                                          'wait_seconds': 0.0})
+                _mergestats(classstats['commands'], stats['commands'])
+                _mergestats(classstats['waits'], stats['waits'])
+                _mergestats(classstats['requests'], stats['requests'])
+                _mergestats(classstats['queries'], stats['queries'])
+                _mergestats(classstats['proxy'], stats['proxy'])
+                classstats['command_seconds'] += commandseconds
+                classstats['wait_seconds'] += waitseconds
+                _mergestats(commands, stats['commands'])
+                _mergestats(requests, stats['requests'])
+                _mergestats(querystats, stats['queries'])
+                _mergestats(proxystats, stats['proxy'])
+            slowesttests = sorted(tests.iteritems(),
+                                  key=lambda item: item[1]['command_seconds'] + item[1]['wait_seconds'],
+                                  reverse=True)[:top]
+            slowestcommands = sorted(commands.iteritems(),
+                                     key=lambda item: item[1]['seconds'], reverse=True)[:top]
+            slowestrequests = sorted(requests.iteritems(),
+                                     key=lambda item: item[1]['max'], reverse=True)[:top]
+            slowestwaits = sorted(self.waits, reverse=True)[:top]
+            slowestproxyrequests = sorted(proxystats.iteritems(),
+                                          key=lambda item: item[1]['max'], reverse=True)[:top]
+            mostqueries = sorted(querystats.iteritems(),
+                                 key=lambda item: item[1]['max'], reverse=True)[:top]
+            duplicatequeries = sorted(self.duplicateQueries, reverse=True)[:top]
+            pages = {}
+            for path, stats in self.pages.iteritems():
+                pages[path] = {'count': stats['count']}
+                for metric in pagetimings.METRICS:
+                    if metric in stats:
+                        metricstats = stats[metric]
+                        pages[path][metric] = {'mean': metricstats['total'] / float(metricstats['count']),
+                                               'max': metricstats['max']}
+            slowestpages = sorted(pages.iteritems(),
+                                  key=lambda item: item[1].get('load', {}).get('max'),
+                                  reverse=True)[:top]
+        import remote # Imports selenium.webdriver, which is slow
+        return {
+            'tests': tests,
+            'classes': classes,
+            'slowest_tests': [{'test': testid,
+                               'command_seconds': stats['command_seconds'],
+                               'wait_seconds': stats['wait_seconds']}
+                              for testid, stats in slowesttests],
+            'slowest_commands': [dict(stats, command=command)
+                                 for command, stats in slowestcommands],
+            'slowest_requests': [dict(stats, request=request)
+                                 for request, stats in slowestrequests],
+            'slowest_waits': [{'seconds': seconds, 'wait': name, 'test': testid,
+                               'polls': polls, 'timedout': timedout}
+                              for seconds, name, testid, polls, timedout in slowestwaits],
+            'slowest_proxy_requests': [dict(stats, request=request)
+                                       for request, stats in slowestproxyrequests],
+            'most_queries': [dict(stats, request=request)
+                             for request, stats in mostqueries],
+            'duplicate_queries': [{'count': count, 'sql': sql, 'request': request, 'test': testid}
+                                  for count, sql, request, testid in duplicatequeries],
+            'pages': pages,
+            'slowest_pages': [dict(stats, path=path) for path, stats in slowestpages],
+            'remote_connections': dict((key, value + self.remoteConnections.get(key, 0))
+                                       for key, value in remote.get_connection_stats().iteritems()),
+        }
+
+    def writeReport(self, path, top=10, summaryfile=None):
+        """
+        Write :meth:`.getReport` to ``path`` as JSON, and write a summary of
+        the slowest tests, commands and waits to ``summaryfile`` (defaults to
+        ``sys.stderr``).
+        """
+        report = self.getReport(top)
+        with open(path, 'w') as reportfile:
+            json.dump(report, reportfile, indent=2, sort_keys=True)
+
+        summaryfile = summaryfile or sys.stderr
+        summaryfile.write('\nSelenium timing report written to {0}\n'.format(path))
+        summaryfile.write('Slowest tests (WebDriver commands + waits):\n')
+        for item in report['slowest_tests']:
+            summaryfile.write('  {command_seconds:8.3f}s + {wait_seconds:8.3f}s  {test}\n'.format(**item))
+        summaryfile.write('Slowest WebDriver commands (total):\n')
+        for item in report['slowest_commands']:
+            summaryfile.write('  {seconds:8.3f}s  {count:6d} x {command} (max {max:.3f}s)\n'.format(**item))
+        summaryfile.write('Slowest live server requests (max):\n')
+        for item in report['slowest_requests']:
+            summaryfile.write('  {max:8.3f}s  {count:6d} x {request} (total {seconds:.3f}s)\n'.format(**item))
+        summaryfile.write('Slowest waits:\n')
+        for item in report['slowest_waits']:
+            summaryfile.write('  {seconds:8.3f}s  {polls:4d} polls  {wait} in {test}{0}\n'.format(
+                ' (timed out)' if item['timedout'] else '', **item))
+        if report['slowest_proxy_requests']:
+            summaryfile.write('Slowest requests through the proxy (max):\n')
+            for item in report['slowest_proxy_requests']:
+                summaryfile.write('  {max:8.3f}s  {count:6d} x {request} (total {seconds:.3f}s)\n'.format(**item))
+        if report['most_queries']:
+            summaryfile.write('Live server requests with the most SQL queries (max):\n')
+            for item in report['most_queries']:
+                summaryfile.write('  {max:6d} queries  {requests:6d} x {request} (total {count} '
+                                  'queries in {seconds:.3f}s)\n'.format(**item))
+        if report['duplicate_queries']:
+            summaryfile.write('Most repeated SQL queries in a single request:\n')
+            for item in report['duplicate_queries']:
+                summaryfile.write('  {count:6d} x {sql}\n           in {request} in {test}\n'.format(**item))
+        if report['slowest_pages']:
+            summaryfile.write('Slowest pages (max load time):\n')
+            for item in report['slowest_pages']:
+                load = item.get('load', {'max': 0, 'mean': 0})
+                requests = item.get('requests', {'max': 0})
+                summaryfile.write('  {0:8.0f}ms {1:6d} x {2} (mean {3:.0f}ms, max {4} requests)\n'.format(
+                    load['max'], item['count'], item['path'], load['mean'], requests['max']))
+        connections = report['remote_connections']
+        if connections['commands']:
+            summaryfile.write('Remote connections: {commands} commands, {connections} connections '
+                              'opened, {reuses} reuses, {retries} retries\n'.format(**connections))
+
+
+def instrument_driver(driver, recorder):
+    """
+    Wrap ``driver.execute`` so the latency of every WebDriver command,
+    including the commands sent by ``WebElement`` objects, is recorded in
+    ``recorder``. Drivers that are already instrumented are not wrapped again.
+    """
+    if getattr(driver, '_seleniumhelpersInstrumented', False):
+        return driver
+    execute = driver.execute
+    def timed_execute(driver_command, params=None):
+        started = time.time()
+        try:
+            return execute(driver_command, params)
+        finally:
+            recorder.recordCommand(driver_command, time.time() - started)
+    driver.execute = timed_execute
+    driver._seleniumhelpersInstrumented = True
+    return driver
+
+
+def get_wait_name():
+    """
+    Get the name of the ``waitFor*`` method that is currently waiting, by
+    looking for the closest caller named ``waitFor*``. Only used when the
+    instrumentation is enabled.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name.startswith('waitFor'):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return 'wait'
+
+
+_recorder = None
+
+def get_recorder():
+    """
+    Get the :class:`.TimingRecorder`, or ``None`` if the instrumentation is
+    not enabled.
+    """
+    return _recorder
+
+def enable_recorder(path, top=10):
+    """
+    Create the process-wide :class:`.TimingRecorder` if it does not exist,
+    and write its report to ``path`` at interpreter exit (see
+    :func:`.write_report`).
+    """
+    global _recorder
+    if _recorder is None:
+        _recorder = TimingRecorder()
+        atexit.register(write_report, path, top)
+    return _recorder
+
+def write_report(path, top=10):
+    """
+    Write the report of the process-wide :class:`.TimingRecorder` to
+    ``path``, and stop recording. Does nothing if the instrumentation is
+    not enabled, or the report has already been written.
+    """
+    global _recorder
+    if _recorder is not None:
+        recorder, _recorder = _recorder, None
+        recorder.writeReport(path, top)
@@ -0,0 +1,280 @@
+"""
+Live server for :class:`seleniumhelpers.SeleniumTestCase` that handles
+requests in a pool of worker threads, and a static file handler that lets
+the browser cache static files.
+
+Enabled by the ``SELENIUM_LIVE_SERVER_THREADS`` and
+``SELENIUM_CACHE_STATIC_FILES`` settings.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import Queue
+import threading
+import time
+import urllib
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.servers.basehttp import WSGIServer
+from django.db import connections
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.test.testcases import LiveServerThread
+from django.test.testcases import QuietWSGIRequestHandler
+from django.test.testcases import _StaticFilesHandler
+from django.utils._os import safe_join
+from django.utils.http import http_date
+
+import instrumentation
+
+
+logger = logging.getLogger('seleniumhelpers.liveserver')
+
+
+class LockReleasingResponse(object):
+    """
+    Wraps a WSGI response to release ``lock`` when the response is closed,
+    after the wrapped response is closed (which sends the
+    ``request_finished`` signal).
+    """
+    def __init__(self, response, lock):
+        self.response = response
+        self.lock = lock
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def close(self):
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self.lock.release()
+
+
+class TimedApplication(object):
+    """
+    Wraps a WSGI application to log the time spent on each request, and
+    record it with :meth:`seleniumhelpers.instrumentation.TimingRecorder.recordRequest`
+    when the instrumentation is enabled.
+
+    :param databaselock: If this is not ``None``, all requests except
+        requests for static and media files hold this lock while they are
+        handled, until the response is closed. Used to serialize access to a
+        database connection that is shared between threads. The lock is held
+        until after the ``request_finished`` signal, so the queries run by a
+        request can be told apart in the shared query log (see
+        :mod:`seleniumhelpers.queries`).
+    """
+    def __init__(self, application, databaselock=None):
+        self.application = application
+        self.databaselock = databaselock
+        self.unlockedprefixes = tuple(url for url in (settings.STATIC_URL, settings.MEDIA_URL)
+                                      if url and url.startswith('/'))
+
+    def __call__(self, environ, start_response):
+        started = time.time()
+        path = environ.get('PATH_INFO', '')
+        if self.databaselock is None or path.startswith(self.unlockedprefixes):
+            response = self.application(environ, start_response)
+        else:
+            self.databaselock.acquire()
+            try:
+                response = LockReleasingResponse(self.application(environ, start_response),
+                                                 self.databaselock)
+            except:
+                self.databaselock.release()
+                raise
+        seconds = time.time() - started
+        request = '{0} {1}'.format(environ.get('REQUEST_METHOD'), path)
+        logger.debug('%s took %.3fs', request, seconds)
+        recorder = instrumentation.get_recorder()
+        if recorder is not None:
+            recorder.recordRequest(request, seconds)
+        return response
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    A ``WSGIServer`` that handles requests in ``workers`` threads.
+
+    :param connections_override: Database connections shared with the
+        thread running the tests (in-memory sqlite databases). They are
+        installed in each worker thread, and requests that may use them are
+        serialized (see :class:`.TimedApplication`).
+    """
+    def __init__(self, *args, **kwargs):
+        self.workers = kwargs.pop('workers')
+        self.connections_override = kwargs.pop('connections_override', None) or {}
+        super(ThreadPoolWSGIServer, self).__init__(*args, **kwargs)
+        self.requests = Queue.Queue()
+        self.threads = []
+        for index in xrange(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def set_app(self, application):
+        databaselock = threading.Lock() if self.connections_override else None
+        super(ThreadPoolWSGIServer, self).set_app(TimedApplication(application, databaselock))
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def work(self):
+        for alias, conn in self.connections_override.items():
+            connections[alias] = conn
+        try:
+            while True:
+                item = self.requests.get()
+                if item is None:
+                    break
+                request, client_address = item
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+        finally:
+            connections.close_all()
+
+    def server_close(self):
+        super(ThreadPoolWSGIServer, self).server_close()
+        for thread in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class ThreadPoolLiveServerThread(LiveServerThread):
+    """
+    A ``LiveServerThread`` that uses :class:`.ThreadPoolWSGIServer`.
+    """
+    def __init__(self, *args, **kwargs):
+        self.workers = kwargs.pop('workers')
+        super(ThreadPoolLiveServerThread, self).__init__(*args, **kwargs)
+
+    def _create_server(self):
+        return ThreadPoolWSGIServer((self.host, self.port), QuietWSGIRequestHandler,
+                                    allow_reuse_address=False, workers=self.workers,
+                                    connections_override=self.connections_override)
+
+
+class CachedStaticFile(object):
+    """
+    The contents of a static file, cached by :class:`.CachingStaticFilesHandler`.
+    """
+    #: Content types that are gzipped in memory if there is no precompressed
+    #: ``.gz`` file.
+    COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/x-javascript',
+                          'application/json', 'application/xml', 'image/svg+xml')
+
+    def __init__(self, path, mtime):
+        self.mtime = mtime
+        with open(path, 'rb') as staticfile:
+            self.content = staticfile.read()
+        self.etag = '"{0}"'.format(hashlib.md5(self.content).hexdigest())
+        contenttype, encoding = mimetypes.guess_type(path)
+        self.contenttype = contenttype or 'application/octet-stream'
+        self.gzipped = self._getGzipped(path)
+
+    def _getGzipped(self, path):
+        gzpath = path + '.gz'
+        if os.path.exists(gzpath) and os.path.getmtime(gzpath) >= self.mtime:
+            with open(gzpath, 'rb') as gzfile:
+                return gzfile.read()
+        if len(self.content) > 256 and self.contenttype.startswith(self.COMPRESSIBLE_TYPES):
+            output = StringIO()
+            gzfile = gzip.GzipFile(fileobj=output, mode='wb', mtime=0)
+            gzfile.write(self.content)
+            gzfile.close()
+            return output.getvalue()
+        return None
+
+
+class CachingStaticFilesHandler(_StaticFilesHandler):
+    """
+    Serves static files with ``ETag`` and ``Cache-Control`` headers so the
+    browser can cache them, and serves gzipped files to browsers that accept
+    them. Precompressed ``<file>.gz`` files are used when they exist.
+
+    The contents of the files are kept in memory for the whole test run, and
+    re-read when their modification time changes. Files are found in
+    ``STATIC_ROOT``, or using the staticfiles finders if ``STATIC_ROOT`` is
+    not set.
+    """
+    #: Files larger than this (in bytes) are served without caching.
+    MAX_CACHED_FILE_SIZE = 10 * 1024 * 1024
+
+    _cache = {}
+    _cachelock = threading.Lock()
+
+    def __init__(self, application):
+        super(CachingStaticFilesHandler, self).__init__(application)
+        from seleniumhelpers import get_setting_with_envfallback
+        self.maxage = get_setting_with_envfallback('SELENIUM_STATIC_MAX_AGE',
+                                                   default=3600, typecast=int)
+
+    def findFile(self, relpath):
+        """
+        Get the absolute path of the static file ``relpath``, or ``None`` if
+        it does not exist.
+        """
+        basedir = self.get_base_dir()
+        if basedir:
+            path = safe_join(basedir, relpath)
+        else:
+            path = finders.find(relpath)
+        if path and os.path.isfile(path):
+            return path
+        return None
+
+    def getCachedFile(self, path):
+        """
+        Get the :class:`.CachedStaticFile` for ``path``, or ``None`` if the
+        file is too large to cache.
+        """
+        stat = os.stat(path)
+        if stat.st_size > self.MAX_CACHED_FILE_SIZE:
+            return None
+        with self._cachelock:
+            cached = self._cache.get(path)
+        if cached is None or cached.mtime != stat.st_mtime:
+            cached = CachedStaticFile(path, stat.st_mtime)
+            with self._cachelock:
+                self._cache[path] = cached
+        return cached
+
+    def serve(self, request):
+        relpath = posixpath.normpath(urllib.unquote(self.file_path(request.path)))
+        relpath = relpath.replace('\\', '/').lstrip('/')
+        path = self.findFile(relpath)
+        if path is None:
+            raise Http404('"{0}" does not exist'.format(relpath))
+        cached = self.getCachedFile(path)
+        if cached is None:
+            return super(CachingStaticFilesHandler, self).serve(request)
+
+        if request.META.get('HTTP_IF_NONE_MATCH') == cached.etag:
+            response = HttpResponseNotModified()
+        else:
+            acceptsgzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+            if acceptsgzip and cached.gzipped is not None:
+                response = HttpResponse(cached.gzipped, content_type=cached.contenttype)
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(cached.content, content_type=cached.contenttype)
+            response['Content-Length'] = len(response.content)
+            response['Last-Modified'] = http_date(cached.mtime)
+        response['ETag'] = cached.etag
+        response['Cache-Control'] = 'public, max-age={0}'.format(self.maxage)
+        response['Vary'] = 'Accept-Encoding'
+        return response
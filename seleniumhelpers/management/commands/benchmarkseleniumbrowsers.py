@@ -0,0 +1,89 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from seleniumhelpers import SeleniumTestCase
+from seleniumhelpers import clear_settings_cache
+from seleniumhelpers import get_browsers
+from seleniumhelpers import get_setting_with_envfallback
+
+
+PROFILES = {
+    'windowed': {'SELENIUM_HEADLESS': ''},
+    'headless': {'SELENIUM_HEADLESS': '1'},
+    'headless-noimages': {'SELENIUM_HEADLESS': '1', 'SELENIUM_DISABLE_IMAGES': '1'},
+}
+
+
+def format_times(times):
+    if not times:
+        return '-'
+    return 'avg {0:7.3f}s  min {1:7.3f}s  max {2:7.3f}s'.format(sum(times) / len(times),
+                                                                 min(times), max(times))
+
+
+class Command(BaseCommand):
+    help = ('Measure driver cold-start time and page load time for SELENIUM_BROWSER\'s '
+            'and launch profiles.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('browsers', nargs='*',
+                            help='Browsers to benchmark. Defaults to SELENIUM_BROWSER.')
+        parser.add_argument('--profiles', default='current',
+                            help=('Comma separated launch profiles: current (use the settings as '
+                                  'they are), {0}. Defaults to current.'.format(', '.join(sorted(PROFILES)))))
+        parser.add_argument('--starts', type=int, default=3,
+                            help='Number of times to start each browser. Defaults to 3.')
+        parser.add_argument('--pageloads', type=int, default=5,
+                            help='Number of page loads for each start. Defaults to 5.')
+        parser.add_argument('--url', default='about:blank',
+                            help='The URL to load. Defaults to about:blank.')
+
+    def handle(self, *args, **options):
+        browsers = options['browsers'] or get_browsers()
+        use_rc = bool(get_setting_with_envfallback('SELENIUM_USE_RC', False))
+        profiles = options['profiles'].split(',')
+        for profile in profiles:
+            if profile != 'current' and profile not in PROFILES:
+                raise CommandError('Invalid profile: {0}'.format(profile))
+        for browser in browsers:
+            for profile in profiles:
+                starts, pageloads, quits = self.benchmark(browser, use_rc, profile, options)
+                print '{0} ({1}):'.format(browser, profile)
+                print '   start:    ', format_times(starts)
+                print '   page load:', format_times(pageloads)
+                print '   quit:     ', format_times(quits)
+
+    def benchmark(self, browser, use_rc, profile, options):
+        environ = PROFILES.get(profile, {})
+        original = dict((key, os.environ.get(key)) for key in environ)
+        os.environ.update(environ)
+        # The settings are cached, so the profile would not be used otherwise
+        clear_settings_cache()
+        try:
+            starts = []
+            pageloads = []
+            quits = []
+            for start in xrange(options['starts']):
+                started = time.time()
+                driver = SeleniumTestCase.getDriver(browser, use_rc)
+                starts.append(time.time() - started)
+                try:
+                    for pageload in xrange(options['pageloads']):
+                        started = time.time()
+                        driver.get(options['url'])
+                        pageloads.append(time.time() - started)
+                finally:
+                    started = time.time()
+                    driver.quit()
+                    quits.append(time.time() - started)
+            return starts, pageloads, quits
+        finally:
+            for key, value in original.iteritems():
+                if value is None:
+                    del os.environ[key]
+                else:
+                    os.environ[key] = value
+            clear_settings_cache()
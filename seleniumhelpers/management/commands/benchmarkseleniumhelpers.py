@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+import json
+import os
+import resource
+import time
+import urllib
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from seleniumhelpers import SeleniumTestCase
+from seleniumhelpers import clear_settings_cache
+from seleniumhelpers.fakewebdriver import FakeWebDriverProcess
+
+
+#: The settings for each mode. ``latency`` is replaced by ``--latency``.
+MODES = {
+    'local': {'latency': 0, 'environ': {}},
+    'remote': {'latency': None, 'environ': {}},
+    'remote-nokeepalive': {'latency': None, 'environ': {'SELENIUM_DISABLE_REMOTE_KEEP_ALIVE': '1'}},
+}
+
+#: Commands that are only used to set up a scenario, and are not counted.
+SETUP_COMMANDS = ('POST url',)
+
+
+class BenchmarkCase(SeleniumTestCase):
+    live_server_url = 'http://fake.invalid'
+
+    def runTest(self):
+        pass
+
+
+def page(elements):
+    """
+    Get the path of a page with the given ``{cssselector: delay}`` elements.
+    See :mod:`seleniumhelpers.fakewebdriver`.
+    """
+    return '/?' + urllib.urlencode(sorted(elements.items()))
+
+
+def scenario_getdriver(bench):
+    with bench.measure():
+        driver = SeleniumTestCase.getDriver('chrome', True)
+    driver.quit()
+
+def scenario_waitforcssselector_present(bench):
+    bench.case.getPath(page({'#result': 0}))
+    with bench.measure():
+        bench.case.waitForCssSelector('#result')
+
+def scenario_waitforcssselector_delayed(bench):
+    bench.case.getPath(page({'#result': bench.delay}))
+    with bench.measure():
+        bench.case.waitForCssSelector('#result')
+
+def scenario_waitfor_delayed(bench):
+    bench.case.getPath(page({'#result': bench.delay}))
+    with bench.measure():
+        bench.case.waitFor(bench.case.selenium,
+                           lambda selenium: selenium.find_elements_by_css_selector('#result'))
+
+def scenario_waitforandfind_many(bench):
+    selectors = ['#field{0}'.format(index) for index in xrange(20)]
+    bench.case.getPath(page(dict((selector, 0) for selector in selectors)))
+    with bench.measure():
+        for repeat in xrange(3):
+            for selector in selectors:
+                bench.case.waitForAndFindElementByCssSelector(selector)
+
+
+#: ``(name, scenario function, settings)``
+SCENARIOS = [
+    ('getDriver', scenario_getdriver, {}),
+    ('waitForCssSelector/present', scenario_waitforcssselector_present, {}),
+    ('waitForCssSelector/delayed', scenario_waitforcssselector_delayed, {}),
+    ('waitForCssSelector/delayed/polling', scenario_waitforcssselector_delayed,
+     {'SELENIUM_DISABLE_EVENT_DRIVEN_WAITS': '1'}),
+    ('waitFor/delayed', scenario_waitfor_delayed, {}),
+    ('waitForAndFindElementByCssSelector/many', scenario_waitforandfind_many, {}),
+    ('waitForAndFindElementByCssSelector/many/cached', scenario_waitforandfind_many,
+     {'SELENIUM_ELEMENT_CACHE': '1'}),
+]
+
+
+@contextmanager
+def environ(settings):
+    original = dict((key, os.environ.get(key)) for key in settings)
+    os.environ.update(settings)
+    clear_settings_cache()
+    try:
+        yield
+    finally:
+        for key, value in original.iteritems():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+        clear_settings_cache()
+
+
+def cputime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Benchmark(object):
+    """
+    Runs a scenario against the fake WebDriver server, and sums the round
+    trips, connections, wall time and CPU time of the blocks measured with
+    :meth:`.measure`.
+    """
+    def __init__(self, server, case, delay):
+        self.server = server
+        self.case = case
+        self.delay = delay
+        self.roundtrips = 0
+        self.connections = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    @contextmanager
+    def measure(self):
+        before = self.server.getStats()
+        started, cpustarted = time.time(), cputime()
+        yield
+        self.wall += time.time() - started
+        self.cpu += cputime() - cpustarted
+        after = self.server.getStats()
+        for command, count in after['commands'].iteritems():
+            if command not in SETUP_COMMANDS:
+                self.roundtrips += count - before['commands'].get(command, 0)
+        # The connection used to get the stats is not counted
+        self.connections += after['connections'] - before['connections'] - 1
+
+
+class Command(BaseCommand):
+    help = ('Measure the round trips, wall time and CPU time used by the seleniumhelpers '
+            'helpers, against a fake WebDriver server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=('Scenarios to run: {0}. Defaults to all.'.format(
+                                ', '.join(name for name, scenario, settings in SCENARIOS))))
+        parser.add_argument('--modes', default='local,remote',
+                            help=('Comma separated modes: {0}. Defaults to '
+                                  'local,remote.'.format(', '.join(sorted(MODES)))))
+        parser.add_argument('--latency', type=float, default=20,
+                            help='Milliseconds added to each command in the remote modes. Defaults to 20.')
+        parser.add_argument('--delay', type=float, default=200,
+                            help='Milliseconds until delayed elements appear. Defaults to 200.')
+        parser.add_argument('--iterations', type=int, default=10,
+                            help='Number of times to run each scenario. Defaults to 10.')
+        parser.add_argument('--json', dest='jsonfile',
+                            help='Write the results as JSON to this file.')
+        parser.add_argument('--compare',
+                            help='Compare the results with a file written by --json.')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or [name for name, scenario, settings in SCENARIOS]
+        scenarios = dict((name, (scenario, settings)) for name, scenario, settings in SCENARIOS)
+        for name in names:
+            if name not in scenarios:
+                raise CommandError('Invalid scenario: {0}'.format(name))
+        modes = options['modes'].split(',')
+        for mode in modes:
+            if mode not in MODES:
+                raise CommandError('Invalid mode: {0}'.format(mode))
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as comparefile:
+                for result in json.load(comparefile)['results']:
+                    baseline[(result['scenario'], result['mode'])] = result
+
+        server = FakeWebDriverProcess()
+        server.start()
+        results = []
+        try:
+            print '{0:<48} {1:<20} {2:>10} {3:>10} {4:>10} {5:>10}{6}'.format(
+                'scenario', 'mode', 'roundtrips', 'conns', 'wall ms', 'cpu ms',
+                '  compared to {0}'.format(options['compare']) if baseline else '')
+            for mode in modes:
+                latency = MODES[mode]['latency']
+                if latency is None:
+                    latency = options['latency']
+                server.setLatency(latency / 1000.0)
+                for name in names:
+                    scenario, settings = scenarios[name]
+                    result = self.benchmark(server, scenario,
+                                            dict(MODES[mode]['environ'], **settings), options)
+                    result.update(scenario=name, mode=mode, latency=latency)
+                    results.append(result)
+                    print '{scenario:<48} {mode:<20} {roundtrips:>10.1f} {connections:>10.1f} {wall:>10.2f} {cpu:>10.2f}{comparison}'.format(
+                        comparison=self.compare(result, baseline.get((name, mode))), **result)
+        finally:
+            server.stop()
+        if options['jsonfile']:
+            with open(options['jsonfile'], 'w') as jsonfile:
+                json.dump({'iterations': options['iterations'], 'delay': options['delay'],
+                           'results': results}, jsonfile, indent=2, sort_keys=True)
+
+    def benchmark(self, server, scenario, settings, options):
+        """
+        Run ``scenario`` ``iterations`` times with ``settings`` as environment
+        variables, and get the mean round trips, connections, wall time and
+        CPU time (in milliseconds) of each run.
+        """
+        settings = dict(settings, SELENIUM_REMOTE_URL=server.url)
+        with environ(settings):
+            from seleniumhelpers.elementcache import ElementCache
+            BenchmarkCase.selenium = SeleniumTestCase.getDriver('chrome', True)
+            case = BenchmarkCase()
+            case._elementCache = ElementCache()
+            bench = Benchmark(server, case, options['delay'] / 1000.0)
+            try:
+                for iteration in xrange(options['iterations']):
+                    scenario(bench)
+            finally:
+                BenchmarkCase.selenium.quit()
+        iterations = float(options['iterations'])
+        return {'roundtrips': bench.roundtrips / iterations,
+                'connections': bench.connections / iterations,
+                'wall': bench.wall * 1000 / iterations,
+                'cpu': bench.cpu * 1000 / iterations}
+
+    def compare(self, result, previous):
+        if previous is None:
+            return ''
+        def change(key):
+            if not previous[key]:
+                return '{0:+.1f}'.format(result[key] - previous[key])
+            return '{0:+.0f}%'.format((result[key] - previous[key]) * 100 / previous[key])
+        return '  roundtrips {0}  wall {1}  cpu {2}'.format(change('roundtrips'), change('wall'),
+                                                            change('cpu'))
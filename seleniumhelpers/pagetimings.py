@@ -0,0 +1,75 @@
+"""
+Page load timings from the Navigation Timing and Resource Timing APIs of the
+browser, used by :meth:`seleniumhelpers.SeleniumTestCase.getPageTimings`.
+"""
+
+#: Javascript that returns the timings of the current page.
+PAGE_TIMINGS_SCRIPT = """
+var performance = window.performance;
+if(!performance || !performance.timing) {
+    return null;
+}
+var timing = performance.timing;
+var sinceStart = function(end) {
+    return end > 0 ? end - timing.navigationStart : null;
+};
+var resources = performance.getEntriesByType ? performance.getEntriesByType('resource') : [];
+var requestsByType = {};
+var transferSize = 0;
+var encodedBodySize = 0;
+for(var i = 0; i < resources.length; i++) {
+    var resource = resources[i];
+    requestsByType[resource.initiatorType] = (requestsByType[resource.initiatorType] || 0) + 1;
+    transferSize += resource.transferSize || 0;
+    encodedBodySize += resource.encodedBodySize || 0;
+}
+return {url: window.location.href,
+        ttfb: sinceStart(timing.responseStart),
+        domContentLoaded: sinceStart(timing.domContentLoadedEventEnd),
+        load: sinceStart(timing.loadEventEnd),
+        requests: resources.length,
+        requestsByType: requestsByType,
+        transferSize: transferSize,
+        encodedBodySize: encodedBodySize};
+"""
+
+#: The numeric values of the dict returned by :func:`.get_page_timings`.
+METRICS = ('ttfb', 'domContentLoaded', 'load', 'requests', 'transferSize', 'encodedBodySize')
+
+
+def get_page_timings(driver):
+    """
+    Get the timings of the page currently loaded in ``driver`` in a single
+    browser round trip.
+
+    :return: ``None`` if the browser does not support the Navigation Timing
+        API. Otherwise a dict with these keys:
+
+        ``url``
+            The URL of the page.
+        ``ttfb``
+            Milliseconds from the start of the navigation until the first
+            byte of the response was received.
+        ``domContentLoaded``
+            Milliseconds until the ``DOMContentLoaded`` event had been
+            handled.
+        ``load``
+            Milliseconds until the ``load`` event had been handled.
+        ``requests``
+            The number of resources (scripts, stylesheets, images, AJAX
+            requests, ...) requested by the page, not including the page
+            itself.
+        ``requestsByType``
+            The number of requests for each ``initiatorType`` (``script``,
+            ``link``, ``img``, ``xmlhttprequest``, ...).
+        ``transferSize``
+            The size, in bytes, of the resources including headers. Resources
+            served from the browser cache count as ``0``.
+        ``encodedBodySize``
+            The size, in bytes, of the (compressed) resource bodies.
+
+        ``domContentLoaded`` and ``load`` are ``None`` if the events have not
+        been handled yet. Browsers keep a limited number of resource entries
+        (usually 150 or 250), so ``requests`` stops counting at that limit.
+    """
+    return driver.execute_script(PAGE_TIMINGS_SCRIPT)
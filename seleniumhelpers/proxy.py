@@ -0,0 +1,291 @@
+"""
+Local HTTP proxy that keeps the browser from waiting for third-party hosts
+(analytics, fonts, external APIs, ...).
+
+Enabled by the ``SELENIUM_PROXY`` setting. Requests for the live server and
+for the hosts in ``SELENIUM_PROXY_ALLOW`` are forwarded. Requests for other
+services on the local machine are never forwarded. Requests for other
+hosts are answered from the fixtures in ``SELENIUM_PROXY_FIXTURES``, or with
+an empty response, without leaving the machine.
+"""
+import atexit
+import BaseHTTPServer
+import fnmatch
+import httplib
+import mimetypes
+import os
+import select
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+
+import instrumentation
+
+
+#: Hosts that are only forwarded for the live server.
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '0.0.0.0', '::1')
+
+#: Headers that only apply to a single connection, and are not forwarded.
+HOP_BY_HOP_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-authenticate',
+                                'proxy-authorization', 'proxy-connection', 'te',
+                                'trailers', 'transfer-encoding', 'upgrade'])
+
+
+class ProxyRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles a request sent to :class:`.StubProxyServer`.
+    """
+    def log_message(self, format, *args):
+        pass
+
+    def do_CONNECT(self):
+        started, page = time.time(), self.server.page
+        host, port = self.path.rsplit(':', 1)
+        # The live server does not use HTTPS, so local hosts are never tunneled
+        if not self.server.isLocal(host) and self.server.isAllowed(host, int(port)):
+            action = 'allowed'
+            status = self.tunnel(host, int(port))
+        else:
+            # The request is encrypted, so fixtures can not be served for it
+            action, status = 'blocked', 403
+            self.send_error(status)
+        self.server.recordRequest(page, 'CONNECT', self.path, action, status, time.time() - started)
+
+    def handleRequest(self):
+        started, page = time.time(), self.server.page
+        parts = urlparse.urlsplit(self.path)
+        if self.server.isAllowed(parts.hostname, parts.port or 80):
+            action = 'allowed'
+            status = self.forward(parts)
+        else:
+            fixture = self.server.findFixture(parts)
+            if fixture is not None:
+                action = 'fixture'
+                status = self.sendFixture(fixture)
+            else:
+                action = 'blocked'
+                status = self.sendEmpty()
+        self.server.recordRequest(page, self.command, self.path, action, status, time.time() - started)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_OPTIONS = do_PATCH = handleRequest
+
+    def forward(self, parts):
+        body = None
+        if 'Content-Length' in self.headers:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        headers = dict((key, value) for key, value in self.headers.items()
+                       if key.lower() not in HOP_BY_HOP_HEADERS)
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        connection = httplib.HTTPConnection(parts.hostname, parts.port or 80,
+                                            timeout=self.server.forwardtimeout)
+        try:
+            connection.request(self.command, path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (socket.error, httplib.HTTPException):
+            self.send_error(502)
+            return 502
+        finally:
+            connection.close()
+        self.send_response(response.status, response.reason)
+        for key, value in response.getheaders():
+            if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != 'content-length':
+                self.send_header(key, value)
+        self.send_header('Content-Length', len(content))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+        return response.status
+
+    def tunnel(self, host, port):
+        try:
+            upstream = socket.create_connection((host, port), timeout=self.server.forwardtimeout)
+        except socket.error:
+            self.send_error(502)
+            return 502
+        self.wfile.write('HTTP/1.0 200 Connection established\r\n\r\n')
+        self.wfile.flush()
+        sockets = [self.connection, upstream]
+        try:
+            while True:
+                readable, writable, failed = select.select(sockets, [], sockets,
+                                                           self.server.forwardtimeout)
+                if failed or not readable:
+                    break
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (upstream if sock is self.connection else self.connection).sendall(data)
+        finally:
+            upstream.close()
+        return 200
+
+    def sendFixture(self, path):
+        with open(path, 'rb') as fixturefile:
+            content = fixturefile.read()
+        contenttype, encoding = mimetypes.guess_type(path)
+        self.send_response(200)
+        self.send_header('Content-Type', contenttype or 'application/octet-stream')
+        self.send_header('Content-Length', len(content))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+        return 200
+
+    def sendEmpty(self):
+        self.send_response(204)
+        self.send_header('Content-Length', 0)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        return 204
+
+
+class StubProxyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP proxy that forwards requests for the live server (see
+    :meth:`.setLiveServer`) and the ``allow``-ed hosts, and answers all other
+    requests itself. Requests for other services on the local machine are
+    never forwarded.
+
+    :param allow: Host patterns that are forwarded, in ``fnmatch`` syntax
+        (E.g.: ``["*.example.com", "api.example.org"]``).
+    :param fixturesdir: Directory with fixtures for hosts that are not
+        allowed, stored as ``<fixturesdir>/<host>/<path>``. ``index`` is used
+        for paths that end with ``/``. The query string is ignored. Requests
+        without a fixture get an empty ``204`` response.
+    :param timeout: Timeout, in seconds, for forwarded requests.
+    :param host: The host (or IP address) to listen on, and that the
+        browsers connect to.
+    """
+    daemon_threads = True
+
+    def __init__(self, allow=(), fixturesdir=None, timeout=10, host='127.0.0.1'):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, 0), ProxyRequestHandler)
+        self.allow = list(allow)
+        self.fixturesdir = fixturesdir
+        self.forwardtimeout = timeout
+        #: The ``(host, port)`` of the live server (see :meth:`.setLiveServer`).
+        self.liveserver = None
+        #: The URL of the page the browser was last told to load (see
+        #: :meth:`.setPage`).
+        self.page = None
+        #: The handled requests as ``(page, method, url, action, status,
+        #: seconds)`` tuples, where ``page`` is :attr:`page` when the request
+        #: was received, and action is ``allowed``, ``fixture`` or ``blocked``.
+        self.requests = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        The ``<host>:<port>`` of the proxy.
+        """
+        return '{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        """
+        Handle requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # The browser closes connections it no longer needs, for example when
+        # it navigates to another page
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def setLiveServer(self, url):
+        """
+        Forward requests for the live server at ``url``.
+        """
+        parts = urlparse.urlsplit(url)
+        self.liveserver = (parts.hostname.lower(), parts.port or 80)
+
+    def isLocal(self, host):
+        """
+        Returns ``True`` if ``host`` is the local machine.
+        """
+        host = (host or '').lower().strip('[]')
+        return host in LOCAL_HOSTS or host.startswith('127.')
+
+    def isAllowed(self, host, port):
+        """
+        Returns ``True`` if requests for ``host:port`` are forwarded. Requests
+        for the local machine are only forwarded to the live server, so the
+        proxy can not be used to reach other local services.
+        """
+        host = (host or '').lower()
+        if self.liveserver is not None and port == self.liveserver[1]:
+            livehost = self.liveserver[0]
+            if host == livehost or (self.isLocal(host) and self.isLocal(livehost)):
+                return True
+        if self.isLocal(host):
+            return False
+        return any(fnmatch.fnmatch(host, pattern) for pattern in self.allow)
+
+    def findFixture(self, parts):
+        """
+        Get the path of the fixture for the ``urlparse.urlsplit`` result
+        ``parts``, or ``None``.
+        """
+        if not self.fixturesdir or not parts.hostname:
+            return None
+        path = parts.path or '/'
+        if path.endswith('/'):
+            path += 'index'
+        hostdir = os.path.abspath(os.path.join(self.fixturesdir, parts.hostname.lower()))
+        fixture = os.path.abspath(os.path.join(hostdir, path.lstrip('/')))
+        if fixture.startswith(hostdir + os.sep) and os.path.isfile(fixture):
+            return fixture
+        return None
+
+    def setPage(self, page):
+        """
+        Set the URL of the page the browser is loading, so the requests
+        that follow are grouped by page in :attr:`requests`.
+        """
+        self.page = page
+
+    def recordRequest(self, page, method, url, action, status, seconds):
+        with self._lock:
+            self.requests.append((page, method, url, action, status, seconds))
+        recorder = instrumentation.get_recorder()
+        if recorder is not None:
+            recorder.recordProxyRequest(method, url, action, seconds)
+
+    def clearRequests(self):
+        with self._lock:
+            del self.requests[:]
+            self.page = None
+
+
+_proxy_server = None
+_proxy_pid = None
+
+def get_proxy_server(allow=(), fixturesdir=None, timeout=10, host='127.0.0.1'):
+    """
+    Get the process-wide :class:`.StubProxyServer`, and start it the first
+    time this is called. The arguments are only used when the proxy is
+    started. The proxy is stopped at interpreter exit.
+    """
+    global _proxy_server, _proxy_pid
+    # A forked worker process does not inherit the thread running the proxy
+    if _proxy_server is None or _proxy_pid != os.getpid():
+        _proxy_server = StubProxyServer(allow, fixturesdir, timeout, host)
+        _proxy_pid = os.getpid()
+        _proxy_server.start()
+        atexit.register(_proxy_server.stop)
+    return _proxy_server
@@ -0,0 +1,193 @@
+"""
+Capture the SQL queries run by the live server while the browser loads pages.
+
+The live server handles requests in its own threads, so the queries can not
+be captured with ``assertNumQueries``. Instead, the ``request_started`` and
+``request_finished`` signals are used to turn on query logging on the
+database connections of the thread handling each request, and the logged
+queries are handed to each active capture (see :func:`.start_capture`) when
+the request has finished.
+
+Used by :meth:`seleniumhelpers.SeleniumTestCase.captureServerQueries`,
+:meth:`seleniumhelpers.SeleniumTestCase.assertMaxQueries` and the
+``SELENIUM_CAPTURE_QUERIES`` setting.
+"""
+import re
+import threading
+import time
+
+from django.core.signals import request_finished
+from django.core.signals import request_started
+from django.db import connections
+
+
+def normalize_sql(sql):
+    """
+    Replace the literal values in ``sql`` with ``?``, so queries that only
+    differ by their parameters (typically N+1 queries) are equal.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\((?:\?, )+\?\)', '(?)', sql)
+
+
+def find_duplicates(queries):
+    """
+    Get the statements that are run more than once in ``queries`` (a list of
+    ``{"sql": ..., "time": ...}`` dicts) after :func:`.normalize_sql`.
+
+    :return: A list of ``(count, normalized sql)`` tuples, the most
+        repeated statement first.
+    """
+    counts = {}
+    for query in queries:
+        sql = normalize_sql(query['sql'])
+        counts[sql] = counts.get(sql, 0) + 1
+    return sorted(((count, sql) for sql, count in counts.iteritems() if count > 1),
+                  reverse=True)
+
+
+class CapturedQueries(object):
+    """
+    The queries captured by :meth:`seleniumhelpers.SeleniumTestCase.captureServerQueries`.
+    """
+    def __init__(self):
+        #: The captured queries as a list of dicts with the ``sql``, ``time``
+        #: (seconds as float), ``alias`` (database alias) and ``request``
+        #: (``"<method> <path>"``) of each query.
+        self.queries = []
+        #: The requests handled while capturing, as ``"<method> <path>"``.
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __call__(self, request, queries):
+        with self._lock:
+            self.requests.append(request)
+            self.queries.extend(queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def count(self):
+        """
+        The number of captured queries.
+        """
+        return len(self.queries)
+
+    @property
+    def seconds(self):
+        """
+        The total time, in seconds, of the captured queries.
+        """
+        return sum(query['time'] for query in self.queries)
+
+    def getDuplicates(self):
+        """
+        Get the statements that were run more than once. See
+        :func:`.find_duplicates`.
+        """
+        return find_duplicates(self.queries)
+
+    def getSummary(self, duplicates=5):
+        """
+        Get a human readable summary of the captured queries, including the
+        ``duplicates`` most repeated statements.
+        """
+        lines = ['{0} queries in {1:.3f}s during {2} requests ({3})'.format(
+            self.count, self.seconds, len(self.requests), ', '.join(self.requests))]
+        for count, sql in self.getDuplicates()[:duplicates]:
+            lines.append('  {0} x {1}'.format(count, sql))
+        return '\n'.join(lines)
+
+
+class _QueryCaptureRegistry(object):
+    def __init__(self):
+        self.callbacks = []
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.connected = False
+
+    def start(self, callback):
+        with self.condition:
+            if not self.connected:
+                request_started.connect(self.requestStarted,
+                                        dispatch_uid='seleniumhelpers.queries.started')
+                request_finished.connect(self.requestFinished,
+                                         dispatch_uid='seleniumhelpers.queries.finished')
+                self.connected = True
+            self.callbacks.append(callback)
+
+    def stop(self, callback):
+        with self.condition:
+            self.callbacks.remove(callback)
+
+    def requestStarted(self, sender, environ=None, **kwargs):
+        with self.condition:
+            if not self.callbacks:
+                return
+            self.inflight += 1
+        environ = environ or {}
+        state = {'request': '{0} {1}'.format(environ.get('REQUEST_METHOD'),
+                                             environ.get('PATH_INFO', '')),
+                 'connections': []}
+        for connection in connections.all():
+            state['connections'].append((connection, len(connection.queries_log),
+                                         connection.force_debug_cursor))
+            connection.force_debug_cursor = True
+        self.local.state = state
+
+    def requestFinished(self, sender, **kwargs):
+        state = getattr(self.local, 'state', None)
+        if state is None:
+            return
+        self.local.state = None
+        queries = []
+        for connection, start, force_debug_cursor in state['connections']:
+            connection.force_debug_cursor = force_debug_cursor
+            for query in list(connection.queries_log)[start:]:
+                queries.append({'sql': query['sql'], 'time': float(query['time']),
+                                'alias': connection.alias, 'request': state['request']})
+        with self.condition:
+            callbacks = list(self.callbacks)
+            self.inflight -= 1
+            self.condition.notify_all()
+        for callback in callbacks:
+            callback(state['request'], queries)
+
+    def waitForRequests(self, timeout):
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.inflight > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+_registry = _QueryCaptureRegistry()
+
+def start_capture(callback):
+    """
+    Call ``callback(request, queries)`` when each request handled by the
+    live server has finished, until :func:`.stop_capture` is called.
+    ``request`` is ``"<method> <path>"``, and ``queries`` is a list of
+    query dicts (see :attr:`.CapturedQueries.queries`).
+    """
+    _registry.start(callback)
+
+def stop_capture(callback):
+    """
+    Stop calling ``callback`` (see :func:`.start_capture`).
+    """
+    _registry.stop(callback)
+
+def wait_for_requests(timeout):
+    """
+    Wait until the requests that were handled while a capture was active have
+    finished. Returns ``False`` if there are unfinished requests after
+    ``timeout`` seconds.
+    """
+    return _registry.waitForRequests(timeout)
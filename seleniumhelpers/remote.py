@@ -0,0 +1,106 @@
+"""
+Command executor for ``webdriver.Remote`` that keeps its connections to the
+remote server (selenium server, grid or ghostdriver) alive.
+
+Used by :meth:`seleniumhelpers.SeleniumTestCase.getCommandExecutor` when
+``SELENIUM_USE_RC`` is enabled or ``SELENIUM_BROWSER`` is ``phantomjs``.
+"""
+import threading
+
+import urllib3
+from urllib3.util.retry import Retry
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+
+
+#: HTTP methods that are retried when the connection is dropped after the
+#: request was sent. WebDriver commands that use these methods only read or
+#: delete state, so sending them twice is safe. Requests that fail before they
+#: are sent are retried for all methods.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'DELETE', 'OPTIONS'])
+
+
+class ConnectionStats(object):
+    """
+    Counts the commands sent by :class:`.PooledRemoteConnection`, the number
+    of connections opened, the number of commands sent on a reused
+    connection, and the number of retries.
+    """
+    def __init__(self):
+        self.commands = 0
+        self.connections = 0
+        self.reuses = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record(self, connections, retries):
+        """
+        Record a command that opened ``connections`` new connections and was
+        retried ``retries`` times.
+        """
+        with self._lock:
+            self.commands += 1
+            self.connections += connections
+            self.reuses += max(0, retries + 1 - connections)
+            self.retries += retries
+
+    def asDict(self):
+        with self._lock:
+            return {'commands': self.commands, 'connections': self.connections,
+                    'reuses': self.reuses, 'retries': self.retries}
+
+
+_total_stats = ConnectionStats()
+
+def get_connection_stats():
+    """
+    Get the :meth:`.ConnectionStats.asDict` of all the
+    :class:`.PooledRemoteConnection` objects in this process.
+    """
+    return _total_stats.asDict()
+
+
+def _create_retry(retries):
+    kwargs = {'total': retries, 'connect': retries, 'read': retries,
+              'redirect': False, 'status': 0, 'raise_on_status': False}
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+    except TypeError: # urllib3 < 1.26
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+
+class _CountingPoolManager(urllib3.PoolManager):
+    def __init__(self, statslist, **kwargs):
+        self.statslist = statslist
+        super(_CountingPoolManager, self).__init__(**kwargs)
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        pool = self.connection_from_url(url)
+        connections = pool.num_connections
+        response = super(_CountingPoolManager, self).urlopen(method, url, redirect, **kw)
+        retries = len(response.retries.history) if response.retries else 0
+        for stats in self.statslist:
+            stats.record(pool.num_connections - connections, retries)
+        return response
+
+
+class PooledRemoteConnection(RemoteConnection):
+    """
+    A ``RemoteConnection`` that sends commands over a pool of persistent
+    HTTP connections, and retries commands when the connection to the remote
+    server is dropped (see :data:`.IDEMPOTENT_METHODS`).
+
+    :param remote_server_addr: The URL of the remote server.
+    :param maxsize: The maximum number of idle connections kept alive.
+    :param connect_timeout: Timeout, in seconds, for opening a connection.
+    :param read_timeout: Timeout, in seconds, for the response to a command.
+    :param retries: The number of times a failed command is retried.
+    """
+    def __init__(self, remote_server_addr, maxsize=4, connect_timeout=10,
+                 read_timeout=120, retries=2, resolve_ip=True):
+        super(PooledRemoteConnection, self).__init__(remote_server_addr, keep_alive=True,
+                                                     resolve_ip=resolve_ip)
+        #: The :class:`.ConnectionStats` for this connection.
+        self.stats = ConnectionStats()
+        timeout = urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+        self._conn = _CountingPoolManager([self.stats, _total_stats], maxsize=maxsize,
+                                          timeout=timeout, retries=_create_retry(retries))
@@ -0,0 +1,382 @@
+"""
+Test runner that runs :class:`seleniumhelpers.SeleniumTestCase` classes in
+parallel worker processes.
+"""
+import re
+import sys
+import time
+import unittest
+from multiprocessing.util import Finalize
+
+from django.test.runner import DiscoverRunner
+from django.test.runner import ParallelTestSuite
+from django.test.runner import RemoteTestResult
+from django.test.runner import RemoteTestRunner
+from django.test.runner import partition_suite_by_case
+from django.test.runner import _init_worker
+
+import artifacts
+import driverpool
+import instrumentation
+from history import DurationHistory
+from seleniumhelpers import get_setting_with_envfallback
+from seleniumhelpers import get_browsers
+from seleniumhelpers import validate_browsers
+from seleniumhelpers import SeleniumTestCase
+
+
+def get_durations_file():
+    """
+    Get the path of the file where the duration history of each test and
+    test class is stored between test runs (see
+    :class:`seleniumhelpers.history.DurationHistory`). Uses
+    :func:`seleniumhelpers.get_setting_with_envfallback` to get
+    ``SELENIUM_DURATIONS_FILE``. Defaults to
+    ``.seleniumhelpers_durations.json``.
+    """
+    return get_setting_with_envfallback('SELENIUM_DURATIONS_FILE',
+                                        default='.seleniumhelpers_durations.json')
+
+def get_duration_history():
+    """
+    Load the :class:`seleniumhelpers.history.DurationHistory` stored in
+    :func:`.get_durations_file`, keeping ``SELENIUM_DURATIONS_HISTORY_SIZE``
+    (defaults to ``10``) runs of each test.
+    """
+    return DurationHistory(get_durations_file(),
+                           size=get_setting_with_envfallback('SELENIUM_DURATIONS_HISTORY_SIZE',
+                                                             default=10, typecast=int))
+
+
+def get_test_class_id(test):
+    return '{0}.{1}'.format(test.__class__.__module__, test.__class__.__name__)
+
+def is_selenium_test(test):
+    return isinstance(test, SeleniumTestCase)
+
+
+def get_browser_test_class(testclass, browser):
+    """
+    Get a subclass of ``testclass`` that runs with ``browser``
+    (see :attr:`seleniumhelpers.SeleniumTestCase.seleniumBrowser`). The
+    subclass is named ``<testclass name>_<browser>``, so results are labelled
+    with the browser. It is added to the module of ``testclass`` so that it
+    can be pickled and sent to worker processes.
+    """
+    name = '{0}_{1}'.format(testclass.__name__, re.sub(r'\W', '', browser))
+    module = sys.modules[testclass.__module__]
+    browserclass = getattr(module, name, None)
+    if browserclass is None:
+        browserclass = type(name, (testclass,), {'seleniumBrowser': browser,
+                                                 '__module__': testclass.__module__})
+        setattr(module, name, browserclass)
+    return browserclass
+
+def expand_browser_matrix(suite, browsers):
+    """
+    Replace each :class:`seleniumhelpers.SeleniumTestCase` in ``suite`` with
+    one copy for each of the given ``browsers`` (see
+    :func:`.get_browser_test_class`).
+    """
+    expanded = unittest.TestSuite()
+    for subsuite in partition_suite_by_case(suite):
+        tests = list(subsuite)
+        if not is_selenium_test(tests[0]):
+            expanded.addTests(tests)
+            continue
+        for browser in browsers:
+            browserclass = get_browser_test_class(tests[0].__class__, browser)
+            expanded.addTests(browserclass(test._testMethodName) for test in tests)
+    return expanded
+
+
+def balance_shards(subsuites, durations, count):
+    """
+    Split ``subsuites`` (one suite per test class) into ``count`` shards with
+    roughly the same total duration. Uses the ``durations`` of previous runs,
+    and estimates the duration of unknown test classes from the average
+    duration per test.
+
+    Returns a list of ``(estimated seconds, [subsuite, ...])`` tuples.
+    """
+    knowntests = 0
+    knownseconds = 0.0
+    for subsuite in subsuites:
+        classid = get_test_class_id(list(subsuite)[0])
+        if classid in durations:
+            knowntests += subsuite.countTestCases()
+            knownseconds += durations[classid]
+    secondspertest = knownseconds / knowntests if knowntests else 1.0
+
+    def estimate(subsuite):
+        classid = get_test_class_id(list(subsuite)[0])
+        return durations.get(classid, subsuite.countTestCases() * secondspertest)
+
+    loads = [0.0] * count
+    shards = [[] for index in xrange(count)]
+    for subsuite in sorted(subsuites, key=estimate, reverse=True):
+        index = loads.index(min(loads))
+        loads[index] += estimate(subsuite)
+        shards[index].append(subsuite)
+    return [(seconds, shard) for seconds, shard in zip(loads, shards) if shard]
+
+
+def order_slowest_first(subsuites, durations):
+    """
+    Sort ``subsuites`` (one suite per test class) by the ``durations`` of
+    previous runs, the slowest test class first. Test classes without a
+    duration are run last, in their original order.
+    """
+    def key(subsuite):
+        return -durations.get(get_test_class_id(list(subsuite)[0]), 0.0)
+    return sorted(subsuites, key=key)
+
+
+def _finalize_worker():
+    if driverpool._driver_pool is not None:
+        driverpool._driver_pool.quit_all()
+    if artifacts._artifact_writer is not None:
+        artifacts._artifact_writer.flush()
+
+def _init_selenium_worker(counter):
+    """
+    Switch to the databases dedicated to this worker (see
+    ``django.test.runner._init_worker``), and make sure drivers pooled by
+    the worker are quit, and failure artifacts are written, when the worker
+    exits. Multiprocessing workers do not run ``atexit`` handlers.
+    """
+    _init_worker(counter)
+    # The timings recorded by the main process before the fork are reported
+    # by the main process
+    instrumentation._recorder = None
+    Finalize(None, _finalize_worker, exitpriority=10)
+
+
+class TimedRemoteTestResult(RemoteTestResult):
+    """
+    Records the duration of each test as an ``addSeleniumDuration`` event.
+    """
+    def startTest(self, test):
+        self._testStarted = time.time()
+        super(TimedRemoteTestResult, self).startTest(test)
+
+    def stopTest(self, test):
+        self.events.append(('addSeleniumDuration', self.test_index,
+                            time.time() - self._testStarted))
+        super(TimedRemoteTestResult, self).stopTest(test)
+
+
+class TimedRemoteTestRunner(RemoteTestRunner):
+    """
+    Sends the timings recorded while running the tests (see
+    :meth:`seleniumhelpers.instrumentation.TimingRecorder.popState`) to the
+    main process as an ``addSeleniumTimings`` event.
+    """
+    resultclass = TimedRemoteTestResult
+
+    def run(self, test):
+        result = super(TimedRemoteTestRunner, self).run(test)
+        recorder = instrumentation.get_recorder()
+        if recorder is not None:
+            result.events.append(('addSeleniumTimings', 0, recorder.popState()))
+        return result
+
+
+class DurationRecordingResultMixin(object):
+    """
+    Mixin for the result class of :class:`.SeleniumTestRunner` that records
+    the duration of each :class:`seleniumhelpers.SeleniumTestCase` test in
+    :attr:`seleniumDurations`. Tests run in worker processes are recorded
+    from the ``addSeleniumDuration`` events sent by
+    :class:`.TimedRemoteTestResult`, and their timings are collected in
+    :attr:`seleniumTimings` from the ``addSeleniumTimings`` events sent by
+    :class:`.TimedRemoteTestRunner`.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DurationRecordingResultMixin, self).__init__(*args, **kwargs)
+        #: ``{test id: seconds}``
+        self.seleniumDurations = {}
+        #: The :meth:`seleniumhelpers.instrumentation.TimingRecorder.popState`
+        #: of each worker process run.
+        self.seleniumTimings = []
+        self._seleniumTestStarted = None
+
+    def startTest(self, test):
+        self._seleniumTestStarted = time.time()
+        super(DurationRecordingResultMixin, self).startTest(test)
+
+    def addSeleniumDuration(self, test, seconds):
+        self.seleniumDurations[test.id()] = seconds
+        self._seleniumTestStarted = None
+
+    def addSeleniumTimings(self, test, state):
+        self.seleniumTimings.append(state)
+
+    def stopTest(self, test):
+        super(DurationRecordingResultMixin, self).stopTest(test)
+        if self._seleniumTestStarted is not None and is_selenium_test(test):
+            self.seleniumDurations[test.id()] = time.time() - self._seleniumTestStarted
+        self._seleniumTestStarted = None
+
+
+class SeleniumParallelTestSuite(ParallelTestSuite):
+    """
+    Runs the given :class:`seleniumhelpers.SeleniumTestCase` tests in
+    ``processes`` worker processes. Each worker uses its own test database,
+    its own live server and its own drivers.
+
+    Test classes are split into shards with roughly the same total duration
+    using :func:`.balance_shards` and the median durations in ``history``
+    (a :class:`seleniumhelpers.history.DurationHistory`).
+    """
+    init_worker = _init_selenium_worker
+    runner_class = TimedRemoteTestRunner
+
+    def __init__(self, suite, processes, failfast=False, history=None):
+        super(SeleniumParallelTestSuite, self).__init__(suite, processes, failfast)
+        durations = history.getClassDurations() if history else {}
+        shards = balance_shards(self.subsuites, durations, processes)
+        self.subsuites = [unittest.TestSuite(test for subsuite in shard for test in subsuite)
+                          for seconds, shard in shards]
+
+
+class SeleniumTestRunner(DiscoverRunner):
+    """
+    Extends ``django.test.runner.DiscoverRunner`` to run
+    :class:`seleniumhelpers.SeleniumTestCase` classes in parallel worker
+    processes. All other tests are run first, in the main process.
+
+    Enable it with ``TEST_RUNNER = 'seleniumhelpers.runner.SeleniumTestRunner'``
+    in ``settings.py``. The number of workers is set with the
+    ``--selenium-workers`` option or the ``SELENIUM_TEST_WORKERS`` setting.
+
+    If ``SELENIUM_BROWSER`` lists more than one browser, each selenium test
+    class is run once for each browser (see :func:`.expand_browser_matrix`),
+    using at least one worker for each browser.
+
+    The duration of each selenium test is stored in a
+    :class:`seleniumhelpers.history.DurationHistory`. Without parallel
+    workers, the slowest test classes are run first if ``--selenium-order``
+    or ``SELENIUM_TEST_ORDER`` is ``slowest``. Tests that are more than
+    ``SELENIUM_REGRESSION_THRESHOLD`` percent slower than their median
+    duration are listed when the tests have finished.
+    """
+    selenium_test_suite = SeleniumParallelTestSuite
+
+    #: Values for ``--selenium-order``.
+    ORDER_DEFAULT = 'default'
+    ORDER_SLOWEST = 'slowest'
+
+    def __init__(self, selenium_workers=None, selenium_order=None, **kwargs):
+        super(SeleniumTestRunner, self).__init__(**kwargs)
+        if selenium_workers is None:
+            selenium_workers = get_setting_with_envfallback('SELENIUM_TEST_WORKERS',
+                                                            default=1, typecast=int)
+        if selenium_order is None:
+            selenium_order = get_setting_with_envfallback('SELENIUM_TEST_ORDER',
+                                                          default=self.ORDER_DEFAULT)
+        self.selenium_workers = selenium_workers
+        self.selenium_order = selenium_order
+        self.history = get_duration_history()
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super(SeleniumTestRunner, cls).add_arguments(parser)
+        parser.add_argument(
+            '--selenium-workers', dest='selenium_workers', default=None, type=int,
+            metavar='N',
+            help='Run selenium tests using N parallel processes. Defaults to SELENIUM_TEST_WORKERS.',
+        )
+        parser.add_argument(
+            '--selenium-order', dest='selenium_order', default=None,
+            choices=[cls.ORDER_DEFAULT, cls.ORDER_SLOWEST],
+            help='Run the slowest selenium test classes first ("slowest"). '
+                 'Defaults to SELENIUM_TEST_ORDER.',
+        )
+
+    def get_resultclass(self):
+        resultclass = super(SeleniumTestRunner, self).get_resultclass() or unittest.TextTestResult
+        return type('DurationRecording' + resultclass.__name__,
+                    (DurationRecordingResultMixin, resultclass), {})
+
+    def run_suite(self, suite, **kwargs):
+        # Create the run ID before the workers are forked, so they share it
+        artifacts.get_run_id()
+        result = super(SeleniumTestRunner, self).run_suite(suite, **kwargs)
+        durations = result.seleniumDurations
+        if durations:
+            threshold = get_setting_with_envfallback('SELENIUM_REGRESSION_THRESHOLD',
+                                                     default=0, typecast=float)
+            if threshold > 0:
+                self.reportRegressions(self.history.findRegressions(durations, threshold))
+            self.history.addRun(durations)
+            self.history.save()
+        self.writeTimingReport(result.seleniumTimings)
+        return result
+
+    def writeTimingReport(self, timings):
+        """
+        Merge the ``timings`` sent by the worker processes into the timings
+        recorded in this process, and write a single timing report to
+        ``SELENIUM_TIMING_REPORT``.
+        """
+        path = get_setting_with_envfallback('SELENIUM_TIMING_REPORT')
+        if not path:
+            return
+        top = get_setting_with_envfallback('SELENIUM_TIMING_REPORT_TOP',
+                                           default=10, typecast=int)
+        if timings:
+            recorder = instrumentation.enable_recorder(path, top)
+            for state in timings:
+                recorder.merge(state)
+        instrumentation.write_report(path, top)
+
+    def reportRegressions(self, regressions):
+        """
+        Write the ``regressions`` found by
+        :meth:`seleniumhelpers.history.DurationHistory.findRegressions` to
+        ``sys.stderr``.
+        """
+        if not regressions:
+            return
+        sys.stderr.write('\nSelenium tests slower than their median duration:\n')
+        for testid, seconds, usual in regressions:
+            sys.stderr.write('  {0:8.3f}s (median {1:.3f}s, +{2:.0f}%)  {3}\n'.format(
+                seconds, usual, (seconds / usual - 1) * 100 if usual else 0, testid))
+
+    def build_suite(self, test_labels=None, extra_tests=None, **kwargs):
+        suite = super(SeleniumTestRunner, self).build_suite(test_labels, extra_tests, **kwargs)
+        if isinstance(suite, ParallelTestSuite):
+            return suite
+
+        workers = self.selenium_workers
+        browsers = get_browsers()
+        if len(browsers) > 1:
+            validate_browsers(browsers, bool(get_setting_with_envfallback('SELENIUM_USE_RC', False)))
+            suite = expand_browser_matrix(suite, browsers)
+            workers = max(workers, len(browsers))
+        if workers < 2 and self.selenium_order != self.ORDER_SLOWEST:
+            return suite
+
+        seleniumsubsuites = []
+        othertests = self.test_suite()
+        for subsuite in partition_suite_by_case(suite):
+            if is_selenium_test(list(subsuite)[0]):
+                seleniumsubsuites.append(subsuite)
+            else:
+                othertests.addTests(subsuite)
+        seleniumtests = self.test_suite(order_slowest_first(seleniumsubsuites,
+                                                            self.history.getClassDurations()))
+        if workers < 2:
+            othertests.addTests(seleniumtests)
+            return othertests
+
+        seleniumsuite = self.selenium_test_suite(seleniumtests, workers,
+                                                 self.failfast, self.history)
+        if len(seleniumsuite.subsuites) < 2:
+            return suite
+        # Make setup_databases() create a test database clone for each worker
+        self.parallel = len(seleniumsuite.subsuites)
+        seleniumsuite.processes = self.parallel
+        othertests.addTest(seleniumsuite)
+        return othertests
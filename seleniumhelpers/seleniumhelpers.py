@@ -1,34 +1,74 @@
 from unittest import skipIf
+from contextlib import contextmanager
 import os
-from selenium import webdriver
+import time
+import urlparse
 from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+from selenium.common.exceptions import WebDriverException
 from django.test import LiveServerTestCase
-
+from django.utils.encoding import force_text
+from django.test.signals import setting_changed
+
+from driverpool import get_driver_pool
+import waits
+import conditions
+import instrumentation
+import artifacts
+import pagetimings
+import queries
+from liveserver import ThreadPoolLiveServerThread
+from liveserver import CachingStaticFilesHandler
+from proxy import get_proxy_server
+
+# NOTE: selenium.webdriver (and the modules that import it, elementcache and
+#       remote) is imported when it is used, since importing it is slow and
+#       this module is imported by test processes that do not run selenium
+#       tests.
+
+
+_MISSING = object()
+_settings_cache = {}
+
+def _clear_cached_setting(setting, **kwargs):
+    _settings_cache.pop(setting, None)
+setting_changed.connect(_clear_cached_setting, dispatch_uid='seleniumhelpers.settings_cache')
+
+def clear_settings_cache():
+    """
+    Clear the settings cached by :func:`.get_setting_with_envfallback`. The
+    cache is cleared automatically for settings changed with
+    ``override_settings``, but not when ``os.environ`` is changed.
+    """
+    _settings_cache.clear()
 
 def get_setting_with_envfallback(setting, default=None, typecast=None):
     """
     Get the given setting and fall back to the default of not found in
     ``django.conf.settings`` or ``os.environ``.
 
+    The value is looked up the first time a setting is requested, and cached
+    until the setting is changed (see :func:`.clear_settings_cache`).
+
     :param settings: The setting as a string.
     :param default: The fallback if ``setting`` is not found.
     :param typecast:
         A function that converts the given value from string to another type.
         E.g.: Use ``typecast=int`` to convert the value to int before returning.
     """
-    try:
-        from django.conf import settings
-    except ImportError:
-        return default
-    else:
-        fallback = getattr(settings, setting, default)
-        value = os.environ.get(setting, fallback)
-        if typecast:
-            value = typecast(value)
-        return value
+    value = _settings_cache.get(setting, _MISSING)
+    if value is _MISSING:
+        try:
+            from django.conf import settings
+        except ImportError:
+            return default
+        value = os.environ.get(setting, getattr(settings, setting, None))
+        _settings_cache[setting] = value
+    if value is None:
+        value = default
+    if typecast:
+        value = typecast(value)
+    return value
 
 def get_default_timeout():
     """
@@ -38,6 +78,66 @@ def get_default_timeout():
     return get_setting_with_envfallback('SELENIUM_DEFAULT_TIMEOUT', default=4,
                                         typecast=int)
 
+def _resolve_timeout(timeout):
+    if timeout is None:
+        return get_default_timeout()
+    return timeout
+
+def get_browsers():
+    """
+    Get the ``SELENIUM_BROWSER`` setting as a list. The setting can be a
+    single browser, a list of browsers, or a comma separated string of
+    browsers (useful in environment variables). Defaults to ``["Chrome"]``.
+    """
+    browsers = get_setting_with_envfallback('SELENIUM_BROWSER', 'Chrome')
+    if isinstance(browsers, basestring):
+        browsers = browsers.split(',')
+    return [browser.strip() for browser in browsers if browser.strip()]
+
+def get_available_browsers():
+    """
+    Get the names of the WebDriver classes in ``selenium.webdriver``. These
+    are the valid ``SELENIUM_BROWSER`` values unless ``SELENIUM_USE_RC``
+    is used (``phantomjs`` is also valid).
+    """
+    from selenium import webdriver
+    from selenium.webdriver.remote.webdriver import WebDriver
+    browsers = []
+    for attrname in dir(webdriver):
+        attr = getattr(webdriver, attrname)
+        try:
+            if issubclass(attr, WebDriver):
+                browsers.append(attrname)
+        except TypeError:
+            pass # attr is not a class
+    return browsers
+
+def validate_browsers(browsers, use_rc):
+    """
+    Raise ``ValueError`` unless all the given ``browsers`` are in
+    :func:`.get_available_browsers` (or ``phantomjs``). Browsers are not
+    validated if ``use_rc`` is ``True``, since they are validated against the
+    RC capabilities when the driver is created.
+    """
+    if use_rc:
+        return
+    available = get_available_browsers() + ['phantomjs']
+    invalid = [browser for browser in browsers if browser not in available]
+    if invalid:
+        raise ValueError('Invalid browser(s): {0}. Valid '
+                         'browser-names: {1}'.format(invalid, available))
+
+def get_window_size():
+    """
+    Get the ``SELENIUM_WINDOW_SIZE`` setting (E.g.: ``"1280x1024"``) as a
+    ``(width, height)`` tuple, or ``None`` if it is not set.
+    """
+    window_size = get_setting_with_envfallback('SELENIUM_WINDOW_SIZE')
+    if not window_size:
+        return None
+    width, height = window_size.lower().split('x')
+    return int(width), int(height)
+
 
 
 @skipIf(get_setting_with_envfallback('SKIP_SELENIUMTESTS'),
@@ -46,20 +146,69 @@ class SeleniumTestCase(LiveServerTestCase):
     """
     Extends ``django.test.LiveServerTestCase`` to simplify selenium testing.
     """
+    #: Run the test class with this browser instead of the first browser in
+    #: ``SELENIUM_BROWSER``. Set on the per-browser subclasses created by
+    #: :func:`seleniumhelpers.runner.expand_browser_matrix`.
+    seleniumBrowser = None
+
     @classmethod
     def _getDriver(cls):
-        browser = get_setting_with_envfallback('SELENIUM_BROWSER', 'Chrome')
-        use_rc = get_setting_with_envfallback('SELENIUM_USE_RC', False)
-        return cls.getDriver(browser, bool(use_rc))
+        recorder = instrumentation.get_recorder()
+        started = time.time()
+        driver = cls._getDriverFromSettings()
+        if recorder:
+            recorder.recordCommand('getDriver', time.time() - started)
+            instrumentation.instrument_driver(driver, recorder)
+        return driver
+
+    @classmethod
+    def _getDriverFromSettings(cls):
+        browser = cls.seleniumBrowser or get_browsers()[0]
+        use_rc = bool(get_setting_with_envfallback('SELENIUM_USE_RC', False))
+        if get_setting_with_envfallback('SELENIUM_REUSE_DRIVERS', False):
+            # Drivers from a custom getDriver or getDriverKwargs are only
+            # reused by classes that create them the same way
+            cls._driverPoolKey = (browser, use_rc, cls.getDriver.__func__,
+                                  cls.getDriverKwargs.__func__)
+            return cls._getDriverPool().acquire(cls._driverPoolKey,
+                                                lambda: cls.getDriver(browser, use_rc))
+        else:
+            cls._driverPoolKey = None
+            return cls.getDriver(browser, use_rc)
+
+    @classmethod
+    def _enableTimingReport(cls):
+        path = get_setting_with_envfallback('SELENIUM_TIMING_REPORT')
+        if path:
+            top = get_setting_with_envfallback('SELENIUM_TIMING_REPORT_TOP',
+                                               default=10, typecast=int)
+            recorder = instrumentation.enable_recorder(path, top)
+            recorder.startClass('{0}.{1}'.format(cls.__module__, cls.__name__))
+
+    @classmethod
+    def _releaseDriver(cls):
+        if cls._driverPoolKey is None:
+            cls.selenium.quit()
+        else:
+            cls._getDriverPool().release(cls._driverPoolKey, cls.selenium)
+
+    @classmethod
+    def _getDriverPool(cls):
+        maxsize = get_setting_with_envfallback('SELENIUM_DRIVER_POOL_SIZE',
+                                               default=len(get_browsers()), typecast=int)
+        return get_driver_pool(maxsize)
 
     @classmethod
     def getDriver(cls, browser, use_rc):
         """
         Override this to create customize the ``selenium``-attribute.
 
-        :param browser: The value of the ``SELENIUM_BROWSER`` setting.
+        :param browser: The value of the ``SELENIUM_BROWSER`` setting (or
+            :attr:`.seleniumBrowser`).
         :param use_rc: The value of ``bool(SELENIUM_USE_RC)``.
         """
+        from selenium import webdriver
+        from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
         if use_rc:
             browser = browser.upper()
             desired_capabilities = getattr(DesiredCapabilities, browser, None)
@@ -68,15 +217,141 @@ class SeleniumTestCase(LiveServerTestCase):
                                   if not key.startswith('_') and key.isupper()]
                 raise ValueError('Invalid browser: {0}. Valid '
                                  'browser-names: {1}'.format(browser, valid_browsers))
-            kwargs = {'desired_capabilities': desired_capabilities}
+            # The remote browser can only reach the proxy on SELENIUM_PROXY_HOST,
+            # not on 127.0.0.1
+            if get_setting_with_envfallback('SELENIUM_PROXY_HOST'):
+                desired_capabilities = dict(desired_capabilities, **cls.getProxyCapabilities())
+            url = get_setting_with_envfallback('SELENIUM_REMOTE_URL', 'http://127.0.0.1:4444/wd/hub')
+            kwargs = {'command_executor': cls.getCommandExecutor(url),
+                      'desired_capabilities': desired_capabilities}
             return webdriver.Remote(**kwargs)
         elif browser == 'phantomjs':
-            kwargs = {'command_executor': 'http://localhost:8080/wd/hub',
-                      'desired_capabilities': {'takeScreenshot': False,
-                                               'javascriptEnabled': True}}
-            return webdriver.Remote(**kwargs)
+            desired_capabilities = {'takeScreenshot': False,
+                                    'javascriptEnabled': True}
+            if get_setting_with_envfallback('SELENIUM_DISABLE_IMAGES', False):
+                desired_capabilities['phantomjs.page.settings.loadImages'] = False
+            desired_capabilities.update(cls.getProxyCapabilities())
+            url = get_setting_with_envfallback('SELENIUM_PHANTOMJS_URL', 'http://localhost:8080/wd/hub')
+            kwargs = {'command_executor': cls.getCommandExecutor(url),
+                      'desired_capabilities': desired_capabilities}
+            driver = webdriver.Remote(**kwargs)
+            window_size = get_window_size()
+            if window_size:
+                driver.set_window_size(*window_size)
+            return driver
         else:
-            return getattr(webdriver, browser)()
+            return getattr(webdriver, browser)(**cls.getDriverKwargs(browser))
+
+    @classmethod
+    def getCommandExecutor(cls, url):
+        """
+        Get the ``command_executor`` for the ``webdriver.Remote`` created by
+        :meth:`.getDriver` when ``SELENIUM_USE_RC`` is enabled or
+        ``SELENIUM_BROWSER`` is ``phantomjs``.
+
+        Returns a :class:`seleniumhelpers.remote.PooledRemoteConnection`
+        configured by the ``SELENIUM_REMOTE_*`` settings, or ``url`` if
+        ``SELENIUM_DISABLE_REMOTE_KEEP_ALIVE`` is set.
+
+        :param url: The URL of the remote server.
+        """
+        if get_setting_with_envfallback('SELENIUM_DISABLE_REMOTE_KEEP_ALIVE', False):
+            return url
+        from remote import PooledRemoteConnection
+        return PooledRemoteConnection(
+            url,
+            maxsize=get_setting_with_envfallback('SELENIUM_REMOTE_POOL_SIZE', 4, typecast=int),
+            connect_timeout=get_setting_with_envfallback('SELENIUM_REMOTE_CONNECT_TIMEOUT', 10,
+                                                         typecast=float),
+            read_timeout=get_setting_with_envfallback('SELENIUM_REMOTE_READ_TIMEOUT', 120,
+                                                      typecast=float),
+            retries=get_setting_with_envfallback('SELENIUM_REMOTE_RETRIES', 2, typecast=int))
+
+    @classmethod
+    def getProxy(cls):
+        """
+        Get the :class:`seleniumhelpers.proxy.StubProxyServer` used by the
+        browsers, or ``None`` if ``SELENIUM_PROXY`` is not enabled. The proxy
+        is started the first time this is called.
+        """
+        if not get_setting_with_envfallback('SELENIUM_PROXY', False):
+            return None
+        allow = get_setting_with_envfallback('SELENIUM_PROXY_ALLOW', ())
+        if isinstance(allow, basestring):
+            allow = [host.strip() for host in allow.split(',') if host.strip()]
+        return get_proxy_server(allow,
+                                fixturesdir=get_setting_with_envfallback('SELENIUM_PROXY_FIXTURES'),
+                                timeout=get_setting_with_envfallback('SELENIUM_PROXY_TIMEOUT', 10,
+                                                                     typecast=float),
+                                host=get_setting_with_envfallback('SELENIUM_PROXY_HOST',
+                                                                  '127.0.0.1'))
+
+    @classmethod
+    def getProxyCapabilities(cls):
+        """
+        Get the capabilities that make the browser use :meth:`.getProxy`, or
+        an empty dict if ``SELENIUM_PROXY`` is not enabled. Only added to the
+        capabilities of ``SELENIUM_USE_RC`` browsers if ``SELENIUM_PROXY_HOST``
+        is set.
+        """
+        proxy = cls.getProxy()
+        if proxy is None:
+            return {}
+        return {'proxy': {'proxyType': 'MANUAL',
+                          'httpProxy': proxy.address,
+                          'sslProxy': proxy.address}}
+
+    @classmethod
+    def getDriverKwargs(cls, browser):
+        """
+        Get the keyword arguments for ``selenium.webdriver.<browser>`` used
+        by :meth:`.getDriver`. Creates launch options for ``Chrome`` and
+        ``Firefox`` from the ``SELENIUM_HEADLESS``, ``SELENIUM_DISABLE_IMAGES``
+        and ``SELENIUM_WINDOW_SIZE`` settings, and adds
+        :meth:`.getProxyCapabilities`. Override this to customize the launch
+        options.
+
+        :param browser: The value of the ``SELENIUM_BROWSER`` setting.
+        """
+        from selenium import webdriver
+        headless = get_setting_with_envfallback('SELENIUM_HEADLESS', False)
+        disable_images = get_setting_with_envfallback('SELENIUM_DISABLE_IMAGES', False)
+        window_size = get_window_size()
+        if browser == 'Chrome':
+            options = webdriver.ChromeOptions()
+            if headless:
+                for argument in ('--headless', '--disable-gpu', '--disable-extensions',
+                                 '--no-first-run', '--disable-dev-shm-usage'):
+                    options.add_argument(argument)
+            if disable_images:
+                options.add_experimental_option('prefs', {
+                    'profile.managed_default_content_settings.images': 2})
+            if window_size:
+                options.add_argument('--window-size={0},{1}'.format(*window_size))
+            return dict(options=options, **cls._getProxyKwargs(browser))
+        elif browser == 'Firefox':
+            options = webdriver.FirefoxOptions()
+            if headless:
+                options.add_argument('-headless')
+                options.set_preference('extensions.enabled', False)
+                options.set_preference('layers.acceleration.disabled', True)
+            if disable_images:
+                options.set_preference('permissions.default.image', 2)
+            if window_size:
+                options.add_argument('--width={0}'.format(window_size[0]))
+                options.add_argument('--height={0}'.format(window_size[1]))
+            return dict(options=options, **cls._getProxyKwargs(browser))
+        return {}
+
+    @classmethod
+    def _getProxyKwargs(cls, browser):
+        from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+        capabilities = cls.getProxyCapabilities()
+        if capabilities:
+            # Start from the defaults, since they replace the defaults of the driver
+            defaults = getattr(DesiredCapabilities, browser.upper())
+            return {'desired_capabilities': dict(defaults, **capabilities)}
+        return {}
 
     @classmethod
     def setUpClass(cls):
@@ -90,44 +365,284 @@ class SeleniumTestCase(LiveServerTestCase):
         when running the ``test`` command::
 
             SELENIUM_BROWSER=Firefox python manage.py test
+
+        If ``SELENIUM_REUSE_DRIVERS`` is ``True``, the ``selenium`` attribute
+        is taken from the process-wide :class:`seleniumhelpers.DriverPool`
+        instead of starting a new browser for each test class.
+
+        If ``SELENIUM_TIMING_REPORT`` is set, the ``selenium`` attribute is
+        instrumented to record timings (see :mod:`seleniumhelpers.instrumentation`).
         """
+        cls._enableTimingReport()
 
         #: The selenium testbrowser object.
         cls.selenium = cls._getDriver()
+        cls._loginSessions = {}
+        cls._loginCookie = None
 
         super(SeleniumTestCase, cls).setUpClass()
+        proxy = cls.getProxy()
+        if proxy:
+            proxy.setLiveServer(cls.live_server_url)
+
+    @classmethod
+    def _create_server_thread(cls, connections_override):
+        """
+        Use :class:`seleniumhelpers.liveserver.ThreadPoolLiveServerThread` if
+        ``SELENIUM_LIVE_SERVER_THREADS`` is set, and
+        :class:`seleniumhelpers.liveserver.CachingStaticFilesHandler` if
+        ``SELENIUM_CACHE_STATIC_FILES`` is ``True``.
+        """
+        static_handler = cls.static_handler
+        if get_setting_with_envfallback('SELENIUM_CACHE_STATIC_FILES', False):
+            static_handler = CachingStaticFilesHandler
+        workers = get_setting_with_envfallback('SELENIUM_LIVE_SERVER_THREADS',
+                                               default=0, typecast=int)
+        if workers:
+            return ThreadPoolLiveServerThread(cls.host, static_handler,
+                                              connections_override=connections_override,
+                                              port=cls.port, workers=workers)
+        return cls.server_thread_class(cls.host, static_handler,
+                                       connections_override=connections_override,
+                                       port=cls.port)
 
     @classmethod
     def tearDownClass(cls):
-        cls.selenium.quit()
+        cls._releaseDriver()
         super(SeleniumTestCase, cls).tearDownClass()
 
 
+    def _pre_setup(self):
+        super(SeleniumTestCase, self)._pre_setup()
+        from elementcache import ElementCache
+        self._elementCache = ElementCache()
+        proxy = self.getProxy()
+        if proxy:
+            proxy.clearRequests()
+        recorder = instrumentation.get_recorder()
+        if recorder:
+            recorder.startTest(self._testMethodName)
+            if get_setting_with_envfallback('SELENIUM_CAPTURE_QUERIES', False):
+                queries.start_capture(recorder.recordQueries)
+                self._capturingQueries = True
+
+    def _post_teardown(self):
+        recorder = instrumentation.get_recorder()
+        if recorder:
+            if getattr(self, '_capturingQueries', False):
+                queries.wait_for_requests(get_default_timeout())
+                queries.stop_capture(recorder.recordQueries)
+                self._capturingQueries = False
+            recorder.stopTest()
+        super(SeleniumTestCase, self)._post_teardown()
+
+    def run(self, result=None):
+        """
+        If ``SELENIUM_FAILURE_ARTIFACTS`` is set, the screenshot, page source,
+        browser console log and URL are saved when the test fails (see
+        :mod:`seleniumhelpers.artifacts`).
+        """
+        path = get_setting_with_envfallback('SELENIUM_FAILURE_ARTIFACTS')
+        if path and result is not None:
+            maxsize = get_setting_with_envfallback('SELENIUM_FAILURE_ARTIFACTS_MAX_SIZE',
+                                                   default=100, typecast=int)
+            writer = artifacts.get_artifact_writer(path, maxsize * 1024 * 1024)
+            result = artifacts.FailureCapturingResult(result, writer)
+        return super(SeleniumTestCase, self).run(result)
+
     def getPath(self, path):
         """
         Shortcut for ``self.selenium.get(...)`` with ``path`` prefixed by
-        ``live_server_url`` as argument.
+        ``live_server_url`` as argument. Clears the element cache used by
+        :meth:`.waitForAndFindElementByCssSelector`, and groups the following
+        proxy requests under the URL (see
+        :meth:`seleniumhelpers.proxy.StubProxyServer.setPage`).
+        """
+        self._elementCache.clear()
+        url = '{live_server_url}{path}'.format(live_server_url=self.live_server_url, path=path)
+        proxy = self.getProxy()
+        if proxy:
+            proxy.setPage(url)
+        result = self.selenium.get(url)
+        # The timings are only used by the timing report
+        if (get_setting_with_envfallback('SELENIUM_PAGE_TIMINGS', False)
+                and instrumentation.get_recorder()):
+            self.getPageTimings()
+        return result
+
+    def getPageTimings(self):
+        """
+        Get the load timings, request count and request sizes of the current
+        page in a single browser round trip. See
+        :func:`seleniumhelpers.pagetimings.get_page_timings` for the keys of
+        the returned dict.
+
+        The timings are added to the timing report (see
+        ``SELENIUM_TIMING_REPORT``) when it is enabled. Set
+        ``SELENIUM_PAGE_TIMINGS`` to add the timings of every page loaded by
+        :meth:`.getPath` to the timing report.
+        """
+        timings = pagetimings.get_page_timings(self.selenium)
+        recorder = instrumentation.get_recorder()
+        if recorder and timings:
+            recorder.recordPage(urlparse.urlsplit(timings['url']).path, timings)
+        return timings
+
+    def _getPageTimingsForAssert(self, timings):
+        if timings is None:
+            timings = pagetimings.get_page_timings(self.selenium)
+        if timings is None:
+            self.fail('The browser does not support the Navigation Timing API.')
+        return timings
+
+    def assertPageLoadUnder(self, milliseconds, timings=None, event='load', msg=None):
+        """
+        Fail unless the current page loaded in less than ``milliseconds``.
+
+        :param timings: The result of :meth:`.getPageTimings`. Defaults to
+            the timings of the current page.
+        :param event: The timing to check: ``"load"``, ``"domContentLoaded"``
+            or ``"ttfb"``.
+        """
+        timings = self._getPageTimingsForAssert(timings)
+        value = timings.get(event)
+        if value is None:
+            self.fail(msg or 'The {0} event of {1} has not been handled.'.format(event, timings['url']))
+        if value >= milliseconds:
+            self.fail(msg or '{0} of {1} took {2}ms, which is not less than {3}ms.'.format(
+                event, timings['url'], value, milliseconds))
+
+    def assertMaxRequests(self, count, timings=None, initiatorType=None, msg=None):
+        """
+        Fail if the current page requested more than ``count`` resources (not
+        including the page itself).
+
+        :param timings: The result of :meth:`.getPageTimings`. Defaults to
+            the timings of the current page.
+        :param initiatorType: Only count requests of this type (E.g.:
+            ``"script"``, ``"img"`` or ``"xmlhttprequest"``).
+        """
+        timings = self._getPageTimingsForAssert(timings)
+        if initiatorType:
+            requests = timings['requestsByType'].get(initiatorType, 0)
+        else:
+            requests = timings['requests']
+        if requests > count:
+            self.fail(msg or '{0} made {1} {2}requests, which is more than {3}.'.format(
+                timings['url'], requests, initiatorType + ' ' if initiatorType else '', count))
+
+    @contextmanager
+    def captureServerQueries(self, timeout=None):
+        """
+        Context manager that captures the SQL queries run by the live server
+        while handling the requests made by the browser within the block.
+        When the block exits, it waits up to ``timeout`` seconds (defaults to
+        :func:`.get_default_timeout`) for requests that are still being
+        handled. Requests the browser has not sent yet are not waited for, so
+        wait for the result of AJAX requests within the block.
+
+        Yields a :class:`seleniumhelpers.queries.CapturedQueries`::
+
+            with self.captureServerQueries() as captured:
+                self.getPath('/products/')
+            print captured.count, captured.seconds, captured.getDuplicates()
+        """
+        captured = queries.CapturedQueries()
+        queries.start_capture(captured)
+        try:
+            yield captured
+        finally:
+            queries.wait_for_requests(_resolve_timeout(timeout))
+            queries.stop_capture(captured)
+
+    @contextmanager
+    def assertMaxQueries(self, count, timeout=None, msg=None):
+        """
+        Context manager that fails if the live server runs more than
+        ``count`` SQL queries while handling the requests made by the browser
+        within the block. The failure message lists the most repeated
+        statements. See :meth:`.captureServerQueries`::
+
+            with self.assertMaxQueries(10):
+                self.getPath('/products/')
         """
-        return self.selenium.get('{live_server_url}{path}'.format(live_server_url=self.live_server_url,
-                                                                path=path))
+        with self.captureServerQueries(timeout) as captured:
+            yield captured
+        if captured.count > count:
+            self.fail(msg or 'The live server ran {0} queries, which is more than {1}.\n{2}'.format(
+                captured.count, count, captured.getSummary()))
+
+    #: The path loaded by :meth:`.loginAs` when the browser must be on the
+    #: live server before the session cookie can be added.
+    loginCookiePath = '/robots.txt'
+
+    def loginAs(self, user, path=None):
+        """
+        Log in ``user`` without going through the login form. Creates an
+        authenticated session on the server, and adds the session cookie to
+        ``self.selenium``.
+
+        The session is cached for each user for the lifetime of the test
+        class, and reused as long as it is still valid on the server (sessions
+        stored in the database are removed when the database is flushed
+        after each test). The cookie is only added to the browser when it
+        changes.
+
+        :param user: A ``django.contrib.auth`` user object.
+        :param path: If this is not ``None``, load ``path`` with
+            :meth:`.getPath` after logging in.
+        """
+        from importlib import import_module
+        from django.conf import settings
+        from django.contrib.auth import BACKEND_SESSION_KEY
+        from django.contrib.auth import HASH_SESSION_KEY
+        from django.contrib.auth import SESSION_KEY
+
+        engine = import_module(settings.SESSION_ENGINE)
+        userid = user._meta.pk.value_to_string(user)
+        authhash = user.get_session_auth_hash()
+        session_key = self._loginSessions.get(userid)
+        if session_key is not None:
+            session = engine.SessionStore(session_key)
+            if session.get(SESSION_KEY) != userid or session.get(HASH_SESSION_KEY) != authhash:
+                session_key = None
+        if session_key is None:
+            session = engine.SessionStore()
+            session[SESSION_KEY] = userid
+            session[BACKEND_SESSION_KEY] = getattr(user, 'backend', settings.AUTHENTICATION_BACKENDS[0])
+            session[HASH_SESSION_KEY] = authhash
+            session.save()
+            session_key = session.session_key
+            self._loginSessions[userid] = session_key
+
+        if session_key != self.__class__._loginCookie:
+            if not self.selenium.current_url.startswith(self.live_server_url):
+                self.getPath(self.loginCookiePath)
+            self.selenium.add_cookie({'name': settings.SESSION_COOKIE_NAME,
+                                      'value': session_key,
+                                      'path': '/'})
+            self.__class__._loginCookie = session_key
+        if path is not None:
+            self.getPath(path)
 
     def waitForCssSelector(self, cssselector,
-                           timeout=get_default_timeout(),
+                           timeout=None,
                            within=None, msg='No elements match css selector "{cssselector}".'):
         """
         Wait for the given ``cssselector``.
 
         :param within: The element to run ``find_element_by_css_selector()`` on. Defaults to ``self.selenium``.
         :param timeout: Fail unless the ``cssselector`` is found before ``timeout`` seconds.
+        :return: The elements matching ``cssselector``, found while waiting.
         """
-        within = within or self.selenium
-        self.waitFor(within,
-                     lambda e: e.find_elements_by_css_selector(cssselector),
-                     timeout=timeout,
-                     msg=msg.format(cssselector=cssselector))
+        return self._waitForScript(waits.CSS_SELECTOR_FOUND, [within, cssselector],
+                                   within or self.selenium,
+                                   lambda e: e.find_elements_by_css_selector(cssselector),
+                                   timeout=timeout,
+                                   msg=msg.format(cssselector=cssselector))
 
     def waitForCssSelectorNotFound(self, cssselector,
-                                   timeout=get_default_timeout(),
+                                   timeout=None,
                                    within=None,
                                    msg='CSS selector, "{cssselector}" matches at least one element, when we expected it not to.'):
         """
@@ -136,14 +651,14 @@ class SeleniumTestCase(LiveServerTestCase):
         :param within: The element to run ``find_elements_by_css_selector()`` on. Defaults to ``self.selenium``.
         :param timeout: Fail if the ``cssselector`` is still found after ``timeout`` seconds.
         """
-        within = within or self.selenium
-        self.waitFor(within,
-                     lambda e: len(e.find_elements_by_css_selector(cssselector)) == 0,
-                     timeout=timeout,
-                     msg=msg.format(cssselector=cssselector))
+        self._waitForScript(waits.CSS_SELECTOR_NOT_FOUND, [within, cssselector],
+                            within or self.selenium,
+                            lambda e: len(e.find_elements_by_css_selector(cssselector)) == 0,
+                            timeout=timeout,
+                            msg=msg.format(cssselector=cssselector))
 
     def waitForEnabled(self, element,
-                       timeout=get_default_timeout(),
+                       timeout=None,
                        msg='The element is not enabled.'):
         """
         Wait for the given ``element`` to become enabled (``element.is_enabled() == True``).
@@ -154,53 +669,57 @@ class SeleniumTestCase(LiveServerTestCase):
                      timeout, msg)
 
     def waitForDisabled(self, element,
-                        timeout=get_default_timeout(),
+                        timeout=None,
                         msg='The element is not disabled.'):
         """
         Wait for the given ``element`` to become disabled (``element.is_enabled() == False``).
 
-        :param timeout: Fail unless the ``element`` becomes disabled before ``timeout`` seconds. Defaults to ``10``.
+        :param timeout: Fail unless the ``element`` becomes disabled before ``timeout`` seconds.
         """
         self.waitFor(self.selenium, lambda selenium: not element.is_enabled(),
                      timeout, msg)
 
     def waitForText(self, text,
-                    timeout=get_default_timeout(),
-                    msg='Could not find text "{text}"',
-                    within=None):
-        """
-        Wait for ``text`` to appear in ``selenium.page_source`` or from the text of an element.
-
-        :param within: The element to find text within (uses within.text). If
-            this is not specified, we get text from ``selenium.page_source``.
-        :param timeout: Fail unless the ``text`` appears in ``selenium.page_source`` before ``timeout`` seconds has passed.
-        """
-        def check(s):
-            text = None
-            if within:
-                return text in within.text
-            else:
-                return text in self.page_source
-        self.waitFor(self.selenium, lambda s: check, timeout,
-                     msg=msg.format(text=text))
+                    timeout=None,
+                    msg=u'Could not find text "{text}"',
+                    within=None, regex=False, ignorecase=False):
+        """
+        Wait for ``text`` to appear in the text content of the page or of an
+        element. The text is searched for inside the browser (see
+        :class:`seleniumhelpers.conditions.Text`), so only a boolean is
+        transferred for each check.
+
+        :param within: The element to find text within. If this is not
+            specified, we search the text of the document body.
+        :param timeout: Fail unless the ``text`` appears before ``timeout`` seconds has passed.
+        :param regex: Treat ``text`` as a javascript regular expression.
+        :param ignorecase: Ignore case when matching ``text``.
+        """
+        condition = conditions.Text(text, within=within, regex=regex, ignorecase=ignorecase)
+        script, args = conditions.compile_conditions([condition], conditions.MODE_ALL)
+        self._waitForScript(script, args, self.selenium,
+                            lambda selenium: selenium.execute_script(script, *args),
+                            timeout, msg=force_text(msg).format(text=force_text(text)))
 
     def waitForTitle(self, title,
-                     timeout=get_default_timeout()):
+                     timeout=None):
         """
         Wait until the page title (title-tag) equals the given ``title``.
         """
-        self.waitFor(self.selenium, lambda selenium: selenium.title==title,
-                     timeout=timeout,
-                     msg='Title does not contain "{title}"'.format(**vars()))
+        self._waitForScript(waits.TITLE_EQUALS, [title],
+                            self.selenium, lambda selenium: selenium.title==title,
+                            timeout=timeout,
+                            msg='Title does not contain "{title}"'.format(**vars()))
 
     def waitForTitleContains(self, title,
-                             timeout=get_default_timeout()):
+                             timeout=None):
         """
         Wait until the page title (title-tag) contains the given ``title``.
         """
-        self.waitFor(self.selenium, lambda selenium: title in selenium.title,
-                     timeout=timeout,
-                     msg='Title does not contain "{title}"'.format(**vars()))
+        self._waitForScript(waits.TITLE_CONTAINS, [title],
+                            self.selenium, lambda selenium: title in selenium.title,
+                            timeout=timeout,
+                            msg='Title does not contain "{title}"'.format(**vars()))
 
     def executeScript(self, script, element):
         """
@@ -214,23 +733,154 @@ class SeleniumTestCase(LiveServerTestCase):
         """
         return self.executeScript("return arguments[0].innerHTML", element)
 
+    def getElementStates(self, elements, attributes=(), within=None):
+        """
+        Get the state of many elements in a single browser round trip.
+
+        :param elements: A css selector, or a list of ``WebElement`` objects.
+        :param attributes: Names of attributes to include for each element.
+        :param within: The element to search for the ``elements`` css
+            selector within. Defaults to the document.
+        :return: A list with a dict for each element with these keys:
+            ``displayed``, ``enabled``, ``text``, ``innerHtml`` and
+            ``attributes`` (a dict with the values of the requested
+            ``attributes``, ``None`` for missing attributes).
+
+        Example::
+
+            rows = self.getElementStates('#mytable tbody tr', attributes=['data-id'])
+            self.assertEquals([row['attributes']['data-id'] for row in rows if row['displayed']],
+                              ['1', '3'])
+        """
+        script = conditions.IS_DISPLAYED_FUNCTION + """
+var elements = arguments[0];
+if(typeof elements == 'string') {
+    elements = (arguments[2] || document).querySelectorAll(elements);
+}
+var states = [];
+for(var i = 0; i < elements.length; i++) {
+    var element = elements[i];
+    var attributes = {};
+    for(var j = 0; j < arguments[1].length; j++) {
+        attributes[arguments[1][j]] = element.getAttribute(arguments[1][j]);
+    }
+    var text = element.innerText !== undefined ? element.innerText : element.textContent;
+    states.push({displayed: isDisplayed(element),
+                 enabled: !element.disabled,
+                 text: (text || '').replace(/^\\s+|\\s+$/g, ''),
+                 innerHtml: element.innerHTML,
+                 attributes: attributes});
+}
+return states;
+"""
+        if not isinstance(elements, basestring):
+            elements = list(elements)
+        return self.selenium.execute_script(script, elements, list(attributes), within)
+
     def waitFor(self, item, fn,
-                timeout=get_default_timeout(),
+                timeout=None,
                 msg=None):
         """
         Wait for the ``fn`` function to return ``True``. The ``item`` is
-        forwarded as argument to ``fn``.
+        forwarded as argument to ``fn``. ``fn`` is polled with
+        :func:`seleniumhelpers.waits.poll_until`.
 
         Example (wait for text in an element)::
 
             waitFor(myelem, lambda myelem: len(myelem.text) > 0, msg='myelem is empty')
         """
+        timeout = _resolve_timeout(timeout)
         try:
-            WebDriverWait(item, timeout).until(fn)
+            waits.poll_until(item, fn, timeout)
         except TimeoutException, e:
             errormessage = 'waitFor timed out after {timeout} seconds. Error message: {msg}'.format(**vars())
             self.fail(errormessage)
 
+    def _untilScript(self, condition, args, item, fn, timeout):
+        """
+        Wait for the javascript ``condition`` using
+        :func:`seleniumhelpers.waits.wait_for_script`, and return the result.
+        Falls back to polling ``fn(item)`` with
+        :func:`seleniumhelpers.waits.poll_until` for the rest of the
+        ``timeout`` if ``SELENIUM_DISABLE_EVENT_DRIVEN_WAITS`` is set, or if the
+        script fails (E.g.: when the browser navigates to another page while
+        waiting).
+
+        :raise TimeoutException: If the condition does not hold within ``timeout`` seconds.
+        """
+        if not get_setting_with_envfallback('SELENIUM_DISABLE_EVENT_DRIVEN_WAITS', False):
+            started = time.time()
+            try:
+                return waits.wait_for_script(self.selenium, condition, args, timeout)
+            except TimeoutException:
+                raise
+            except WebDriverException, e:
+                timeout = max(timeout - (time.time() - started), 0)
+        return waits.poll_until(item, fn, timeout)
+
+    def _waitForScript(self, condition, args, item, fn, timeout, msg):
+        """
+        Same as :meth:`._untilScript`, but fails the test with ``msg`` on timeout.
+        """
+        timeout = _resolve_timeout(timeout)
+        try:
+            return self._untilScript(condition, args, item, fn, timeout)
+        except TimeoutException, e:
+            msg = force_text(msg)
+            errormessage = u'waitFor timed out after {timeout} seconds. Error message: {msg}'.format(**vars())
+            self.fail(errormessage)
+
+    def _waitForConditions(self, conditionlist, mode, timeout, msg):
+        timeout = _resolve_timeout(timeout)
+        script, args = conditions.compile_conditions(conditionlist, mode)
+        try:
+            return self._untilScript(script, args, self.selenium,
+                                     lambda selenium: selenium.execute_script(script, *args),
+                                     timeout)
+        except TimeoutException, e:
+            script, args = conditions.compile_conditions(conditionlist, conditions.MODE_EVALUATE)
+            results = self.selenium.execute_script(script, *args)
+            failed = u', '.join(unicode(condition)
+                                for condition, result in zip(conditionlist, results)
+                                if not result)
+            msg = force_text(msg).format(failed=failed)
+            errormessage = u'waitFor timed out after {timeout} seconds. Error message: {msg}'.format(**vars())
+            self.fail(errormessage)
+
+    def waitForAll(self, conditionlist,
+                   timeout=None,
+                   msg=u'These conditions did not hold: {failed}.'):
+        """
+        Wait until all the conditions in ``conditionlist`` hold. The
+        conditions are instances of the classes in
+        :mod:`seleniumhelpers.conditions`, and all of them are checked in a
+        single browser round trip. On timeout, the error message lists the
+        conditions that did not hold.
+
+        Example::
+
+            from seleniumhelpers import conditions
+
+            self.waitForAll([conditions.CssSelector('#myform'),
+                             conditions.Enabled('#myform button'),
+                             conditions.Text('Ready')])
+
+        :param timeout: Fail unless all the conditions hold before ``timeout`` seconds.
+        """
+        self._waitForConditions(conditionlist, conditions.MODE_ALL, timeout, msg)
+
+    def waitForAny(self, conditionlist,
+                   timeout=None,
+                   msg=u'None of these conditions held: {failed}.'):
+        """
+        Wait until at least one of the conditions in ``conditionlist`` holds.
+        Works just like :meth:`.waitForAll`.
+
+        :return: The conditions in ``conditionlist`` that held.
+        """
+        results = self._waitForConditions(conditionlist, conditions.MODE_ANY, timeout, msg)
+        return [condition for condition, result in zip(conditionlist, results) if result]
+
     def failIfCssSelectorFound(self, element, css_selector,
                                msg='CSS selector, "{css_selector}" matches at least one element, when we expected it not to.'):
         """
@@ -245,7 +895,7 @@ class SeleniumTestCase(LiveServerTestCase):
             self.fail(msg=msg.format(css_selector=css_selector))
 
 
-    def waitForDisplayed(self, element, timeout=get_default_timeout(),
+    def waitForDisplayed(self, element, timeout=None,
                          msg='The element is not displayed.'):
         """
         Wait for the given element to be displayed.
@@ -253,7 +903,7 @@ class SeleniumTestCase(LiveServerTestCase):
         self.waitFor(element, lambda e: e.is_displayed(),
                      timeout=timeout, msg=msg)
 
-    def waitForNotDisplayed(self, element, timeout=get_default_timeout(),
+    def waitForNotDisplayed(self, element, timeout=None,
                             msg='The element is not hidden.'):
         """
         Wait for the given element to be hidden.
@@ -261,15 +911,25 @@ class SeleniumTestCase(LiveServerTestCase):
         self.waitFor(element, lambda e: not e.is_displayed(),
                      timeout=timeout, msg=msg)
 
-    def waitForAndFindElementByCssSelector(self, cssselector, within=None, timeout=get_default_timeout()):
+    def waitForAndFindElementByCssSelector(self, cssselector, within=None, timeout=None):
         """
         Use :meth:`.waitForCssSelector` to wait until ``cssselector`` is found,
-        then use ``self.selenium.find_element_by_css_selector`` to locate and
-        return the element.
+        and return the first matching element found while waiting.
+
+        If ``SELENIUM_ELEMENT_CACHE`` is ``True``, the element is cached until
+        the next call to :meth:`.getPath`, and returned without waiting on
+        later calls with the same ``cssselector`` and ``within``, unless it
+        has become stale (see :class:`seleniumhelpers.elementcache.ElementCache`).
 
         :param within: The element to run ``find_element_by_css_selector()`` on. Defaults to ``self.selenium``.
         :param timeout: Fail unless the ``cssselector`` is found before ``timeout`` seconds.
         """
-        within = within or self.selenium
-        self.waitForCssSelector(cssselector, within=within, timeout=timeout)
-        return within.find_element_by_css_selector(cssselector)
+        usecache = get_setting_with_envfallback('SELENIUM_ELEMENT_CACHE', False)
+        if usecache:
+            element = self._elementCache.get(within or self.selenium, cssselector)
+            if element is not None:
+                return element
+        element = self.waitForCssSelector(cssselector, within=within, timeout=timeout)[0]
+        if usecache:
+            self._elementCache.add(within or self.selenium, cssselector, element)
+        return element
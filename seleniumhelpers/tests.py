@@ -0,0 +1,45 @@
+import threading
+import urllib2
+
+from django.conf.urls import url
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import override_settings
+
+from seleniumhelpers import SeleniumTestCase
+
+
+def fourqueries(request):
+    return HttpResponse(str(sum(User.objects.count() for index in xrange(4))))
+
+urlpatterns = [url(r'^fourqueries/$', fourqueries)]
+
+
+class NoBrowser(object):
+    def quit(self):
+        pass
+
+
+@override_settings(ROOT_URLCONF=__name__, SELENIUM_LIVE_SERVER_THREADS=4)
+class TestThreadedServerQueries(SeleniumTestCase):
+    """
+    The queries of concurrent requests to a live server with worker threads
+    that share a database connection (in-memory sqlite) must each be
+    captured exactly once.
+    """
+    @classmethod
+    def getDriver(cls, browser, use_rc):
+        return NoBrowser()
+
+    def test_concurrent_requests(self):
+        def get():
+            urllib2.urlopen(self.live_server_url + '/fourqueries/').read()
+        for attempt in xrange(5):
+            with self.captureServerQueries() as captured:
+                threads = [threading.Thread(target=get) for index in xrange(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEquals(captured.count, 32)
+            self.assertEquals(len(captured.requests), 8)
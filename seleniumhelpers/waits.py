@@ -0,0 +1,162 @@
+"""
+Wait engine used by the ``waitFor*`` methods of
+:class:`seleniumhelpers.SeleniumTestCase`.
+
+Conditions that can be expressed in javascript are evaluated inside the
+browser by :func:`.wait_for_script`, which resolves as soon as the DOM
+changes to satisfy the condition. Conditions that can only be checked in
+Python are polled by :func:`.poll_until` with an interval that starts short
+and grows longer.
+"""
+import time
+
+from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import TimeoutException
+
+import instrumentation
+
+
+#: The first poll interval of :func:`.poll_until`, in seconds.
+POLL_MIN_INTERVAL = 0.01
+
+#: The maximum poll interval of :func:`.poll_until`, in seconds.
+POLL_MAX_INTERVAL = 0.5
+
+#: Each poll interval of :func:`.poll_until` is the previous interval
+#: multiplied by this factor.
+POLL_BACKOFF = 1.5
+
+
+def _record_wait(started, polls, timedout):
+    recorder = instrumentation.get_recorder()
+    if recorder is not None:
+        recorder.recordWait(instrumentation.get_wait_name(), time.time() - started,
+                            polls, timedout)
+
+def poll_until(item, fn, timeout, ignored_exceptions=(NoSuchElementException,)):
+    """
+    Call ``fn(item)`` until it returns a true value, and return the value.
+    Works like ``WebDriverWait(item, timeout).until(fn)``, except that the
+    poll interval starts at :data:`.POLL_MIN_INTERVAL` and grows to
+    :data:`.POLL_MAX_INTERVAL`.
+
+    :param ignored_exceptions: Exceptions raised by ``fn`` that are treated
+        like a false return value.
+    :raise TimeoutException: If ``fn`` does not return a true value within
+        ``timeout`` seconds.
+    """
+    started = time.time()
+    deadline = started + timeout
+    interval = POLL_MIN_INTERVAL
+    polls = 0
+    while True:
+        polls += 1
+        try:
+            value = fn(item)
+            if value:
+                _record_wait(started, polls, False)
+                return value
+        except ignored_exceptions:
+            pass
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            _record_wait(started, polls, True)
+            raise TimeoutException()
+        time.sleep(min(interval, remaining))
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+
+WAIT_SCRIPT = """
+var callback = arguments[arguments.length - 1];
+var timeout = arguments[0];
+var conditionArgs = Array.prototype.slice.call(arguments, 1, arguments.length - 1);
+var condition = function() {
+%(condition)s
+};
+var check = function() {
+    try {
+        return condition.apply(null, conditionArgs);
+    } catch(e) {
+        return false;
+    }
+};
+var result = check();
+if(result) {
+    callback(result);
+    return;
+}
+var done = false;
+var observer = null;
+var interval = null;
+var timer = null;
+var finish = function(value) {
+    if(done) {
+        return;
+    }
+    done = true;
+    if(observer) {
+        observer.disconnect();
+    }
+    clearInterval(interval);
+    clearTimeout(timer);
+    callback(value);
+};
+var onChange = function() {
+    var result = check();
+    if(result) {
+        finish(result);
+    }
+};
+if(window.MutationObserver) {
+    observer = new window.MutationObserver(onChange);
+    observer.observe(document, {childList: true, subtree: true,
+                                attributes: true, characterData: true});
+}
+// Catch changes that are not DOM mutations, such as CSS transitions, and
+// browsers without MutationObserver.
+interval = setInterval(onChange, observer ? 100 : 20);
+timer = setTimeout(function() { finish(false); }, timeout);
+"""
+
+#: Javascript conditions for :func:`.wait_for_script`.
+CSS_SELECTOR_FOUND = """
+var elements = (arguments[0] || document).querySelectorAll(arguments[1]);
+return elements.length > 0 && Array.prototype.slice.call(elements);
+"""
+CSS_SELECTOR_NOT_FOUND = "return (arguments[0] || document).querySelectorAll(arguments[1]).length == 0;"
+TITLE_EQUALS = "return document.title == arguments[0];"
+TITLE_CONTAINS = "return document.title.indexOf(arguments[0]) != -1;"
+
+
+#: The script timeout, in seconds, of a new driver (chromedriver and
+#: geckodriver).
+DEFAULT_SCRIPT_TIMEOUT = 30
+
+def _set_script_timeout(driver, timeout):
+    # Setting the script timeout is a round trip, so only do it when the
+    # current script timeout is too short. The timeout is never lowered below
+    # the default, since the tests may use execute_async_script themselves.
+    if getattr(driver, '_seleniumhelpersScriptTimeout', DEFAULT_SCRIPT_TIMEOUT) < timeout:
+        driver.set_script_timeout(timeout)
+        driver._seleniumhelpersScriptTimeout = timeout
+
+def wait_for_script(driver, condition, args, timeout):
+    """
+    Wait until the javascript ``condition`` returns a true value in the
+    browser, and return the value. ``condition`` is the body of a function
+    that gets ``args`` as ``arguments``. It is checked each time the DOM
+    changes, so the wait resolves as soon as the condition holds.
+
+    :raise TimeoutException: If ``condition`` does not return a true value
+        within ``timeout`` seconds.
+    :raise WebDriverException: If the script fails, for example because the
+        browser navigates to another page while waiting.
+    """
+    started = time.time()
+    _set_script_timeout(driver, timeout + 5)
+    script = WAIT_SCRIPT % {'condition': condition}
+    result = driver.execute_async_script(script, int(timeout * 1000), *args)
+    _record_wait(started, 1, not result)
+    if not result:
+        raise TimeoutException()
+    return result